@@ -0,0 +1,25 @@
+"""
+ASGI config for SuperAwesomeNewsFeed project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (docker-compose runs uvicorn) so the async views
+and the event stream don't hold a worker thread per request.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "SuperAwesomeNewsFeed.settings")
+
+application = get_asgi_application()
+
+if settings.DEBUG:
+    # what runserver did for us: serve the static files while developing
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+
+    application = ASGIStaticFilesHandler(application)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.0/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'newsfeed.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,18 +72,97 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'SuperAwesomeNewsFeed.wsgi.application'
+ASGI_APPLICATION = 'SuperAwesomeNewsFeed.asgi.application'
 
 
 # Database
-# https://docs.djangoproject.com/en/2.0/ref/settings/#databases
+# https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+# SQLite by default. Production runs the refresher and several web workers writing
+# at once, so it sets DJANGO_DB_ENGINE=postgresql and the DJANGO_DB_NAME, _USER,
+# _PASSWORD, _HOST and _PORT of the server.
+
+if os.environ.get('DJANGO_DB_ENGINE', 'sqlite') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DJANGO_DB_NAME', 'newsfeed'),
+            'USER': os.environ.get('DJANGO_DB_USER', 'newsfeed'),
+            'PASSWORD': os.environ.get('DJANGO_DB_PASSWORD', ''),
+            'HOST': os.environ.get('DJANGO_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DJANGO_DB_PORT', '5432'),
+            # keep connections open between requests, checking they still work before reuse
+            'CONN_MAX_AGE': int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if os.environ.get('DJANGO_DB_POOL_SIZE'):
+        # a psycopg connection pool per process, which takes the place of persistent connections
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': 1,
+            'max_size': int(os.environ['DJANGO_DB_POOL_SIZE']),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DJANGO_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            'OPTIONS': {
+                # WAL lets readers carry on while the refresher writes. Writers take the
+                # lock when their transaction starts and wait up to timeout seconds for
+                # each other, instead of failing with "database is locked" halfway through.
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA temp_store=MEMORY;'
+                    'PRAGMA cache_size=-20000;'
+                ),
+            },
+        }
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Files in a temporary directory by default, shared by the web and refresh_feeds
+# processes of one machine: the refresher drops cached pages by bumping versions in
+# it (see newsfeed.cache). Point DJANGO_CACHE_BACKEND/DJANGO_CACHE_LOCATION at a
+# cache server (e.g. memcached) when they run on more than one machine. A
+# LocMemCache is private to each process, so pages aren't cached with it.
 
-DATABASES = {
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'newsfeed-cache')),
     }
 }
 
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+
+# Logging
+# https://docs.djangoproject.com/en/5.2/topics/logging/
+# DJANGO_METRICS_LOG_LEVEL=INFO prints a JSON line per request and feed fetch (see
+# NEWSFEED_METRICS below).
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'newsfeed.metrics': {
+            'handlers': ['console'],
+            'level': os.environ.get('DJANGO_METRICS_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -111,8 +192,6 @@ TIME_ZONE = 'UTC'
 
 USE_I18N = True
 
-USE_L10N = True
-
 USE_TZ = True
 
 
@@ -120,3 +199,116 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Keep the integer primary keys the existing tables were created with
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+
+# Newsfeed refresher (manage.py refresh_feeds)
+
+# Seconds the refresher waits between scans when no feed is due
+NEWSFEED_REFRESH_SLEEP = 30
+
+# Maximum number of feeds polled per scan
+NEWSFEED_REFRESH_BATCH_SIZE = 100
+
+# Seconds a refresher holds the feeds it claimed for a scan, other refreshers leave
+# them alone meanwhile. Once it runs out the feeds of a refresher that died are
+# polled by another one, so it must be longer than a scan can take.
+NEWSFEED_REFRESH_LEASE = 10 * 60
+
+# Maximum number of feeds downloaded at the same time
+NEWSFEED_FETCH_WORKERS = 20
+
+# Maximum number of simultaneous downloads from a single host
+NEWSFEED_FETCH_PER_HOST = 4
+
+# Seconds a single feed download may take before it's abandoned
+NEWSFEED_FETCH_TIMEOUT = 30
+
+# Bytes of a feed read at most, the rest of a larger document is ignored
+NEWSFEED_FETCH_MAX_BYTES = 10 * 1024 * 1024
+
+# Processes parsing downloaded feeds while the next ones download (see
+# newsfeed.utils.parse_responses), one per CPU by default. 0 parses them in the
+# refresher's own thread, between storing one feed and the next.
+NEWSFEED_PARSE_PROCESSES = os.cpu_count() or 1
+
+# Directory keeping the raw body of every feed download, once per distinct body, and
+# the latest response of each feed URL (see newsfeed.rawcache). With
+# NEWSFEED_RAW_CACHE_REPLAY the refresher reads the feeds from there instead of the
+# network, to replay recorded feeds in tests and benchmarks. None keeps nothing.
+NEWSFEED_RAW_CACHE_DIR = os.environ.get('DJANGO_RAW_CACHE_DIR') or None
+NEWSFEED_RAW_CACHE_REPLAY = False
+
+# Number of feed entries checked and inserted per bulk query
+NEWSFEED_INGEST_BATCH_SIZE = 500
+
+# Entries of a single feed document stored at most
+NEWSFEED_FEED_MAX_ENTRIES = 1000
+
+# Feed documents of this many bytes or more are parsed incrementally (see
+# newsfeed.streaming), reading stops after NEWSFEED_STREAM_STOP_AFTER_KNOWN stored
+# entries in a row. None parses everything with feedparser.
+NEWSFEED_STREAM_PARSE_MIN_BYTES = 256 * 1024
+NEWSFEED_STREAM_STOP_AFTER_KNOWN = 5
+
+# Shortest and longest time between two polls of a working feed, in seconds. The
+# interval adapts to how often the feed publishes (see newsfeed.scheduler), and
+# Cache-Control, Expires or Retry-After headers can't put a poll off any longer either.
+NEWSFEED_MIN_POLL_INTERVAL = 5 * 60
+NEWSFEED_MAX_POLL_INTERVAL = 24 * 60 * 60
+
+# Factor by which the interval of a feed grows every time a poll brings no new items
+NEWSFEED_POLL_BACKOFF = 1.5
+
+# Feeds failing this many polls in a row are parked and only retried every NEWSFEED_PARKED_POLL_INTERVAL
+NEWSFEED_PARK_AFTER_FAILURES = 10
+NEWSFEED_PARKED_POLL_INTERVAL = 7 * 24 * 60 * 60
+
+# Number of news items shown per page of the newsfeed
+NEWSFEED_PAGE_SIZE = 50
+
+# Collect comment like counts in memory and write them to the database in batches, every
+# NEWSFEED_LIKES_FLUSH_SIZE likes and at most NEWSFEED_LIKES_FLUSH_INTERVAL seconds after
+# the first like of a batch (see newsfeed.likes). Displayed counts lag behind by up to
+# that much, and likes still buffered when a process is killed are lost from the counts.
+NEWSFEED_LIKES_WRITE_BEHIND = False
+NEWSFEED_LIKES_FLUSH_SIZE = 100
+NEWSFEED_LIKES_FLUSH_INTERVAL = 5
+
+# Seconds a rendered newsfeed, comments or sources page is cached for a user (see
+# newsfeed.cache). Pages are dropped earlier when something on them changes, 0
+# turns the cache off, and so does a LocMemCache (see CACHES).
+NEWSFEED_PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Largest page the JSON API hands out (?limit=), and the number of items read per
+# query while streaming an export
+NEWSFEED_API_MAX_PAGE_SIZE = 200
+NEWSFEED_API_EXPORT_BATCH_SIZE = 500
+
+# Event stream (newsfeed.events): how often each process checks for new events, the
+# seconds between keepalive comments on idle streams, the reconnect delay suggested
+# to browsers, and how long events are kept for clients catching up
+NEWSFEED_EVENTS_POLL_INTERVAL = 1
+NEWSFEED_EVENTS_HEARTBEAT = 15
+NEWSFEED_EVENTS_RETRY = 5
+NEWSFEED_EVENTS_RETENTION = 60 * 60
+# Seconds an event id skipped over is still looked for, in case the transaction that
+# took it commits after one with a later id (see newsfeed.events.Cursor)
+NEWSFEED_EVENTS_COMMIT_GRACE = 30
+
+# Number of results shown for a newsfeed search
+NEWSFEED_SEARCH_LIMIT = 50
+
+# Collect request and feed fetch metrics (newsfeed.metrics): served in the Prometheus
+# text format at /newsfeed/metrics/ to staff users and NEWSFEED_METRICS_ALLOWED_IPS,
+# and logged as JSON lines at INFO level to the newsfeed.metrics logger. False
+# leaves the middleware and query timer out altogether.
+NEWSFEED_METRICS = True
+NEWSFEED_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Address the metrics port of refresh_feeds --metrics-port listens on. The port has
+# no access control of its own, so only bind it to an address reachable from
+# elsewhere (e.g. 0.0.0.0) on a network where anyone may read the metrics.
+NEWSFEED_METRICS_ADDRESS = os.environ.get('DJANGO_METRICS_ADDRESS', '127.0.0.1')
@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from django.test import TestCase
 from django.urls import reverse
 from django.contrib.auth.models import User
@@ -7,6 +8,7 @@ from .forms import RegisterForm
 
 class AuthenticationViewTests(TestCase):
     def setUp(self):
+        cache.clear()
         User.objects.create_user('test', 'test@email.com', 'test1234')
         self.user = User.objects.get(username='test')
 
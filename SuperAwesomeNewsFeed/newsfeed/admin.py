@@ -1,6 +1,11 @@
 from django.contrib import admin
-from .models import SourceRSS, NewsItem, Comments
+from .models import Feed, SourceRSS, NewsItem, ItemState, Comments, CommentLike, Event, RefreshJob
 
+admin.site.register(Feed)
 admin.site.register(SourceRSS)
 admin.site.register(NewsItem)
+admin.site.register(ItemState)
 admin.site.register(Comments)
+admin.site.register(CommentLike)
+admin.site.register(Event)
+admin.site.register(RefreshJob)
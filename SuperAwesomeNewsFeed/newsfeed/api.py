@@ -0,0 +1,201 @@
+import json
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from .models import SourceRSS, NewsItem, Comments
+from .pagination import InvalidCursor, paginate, parse_since
+from .search import search_items
+
+# what ?fields= can ask for, by name in the response and the values() queryset
+ITEM_FIELDS = {
+    'id': 'id',
+    'feed': 'feed_id',
+    'title': 'title',
+    'summary': 'summary',
+    'link': 'link',
+    'published_at': 'published_at',
+    'fetched_at': 'fetched_at',
+    'source_name': 'source_name',
+    'comment_count': 'comment_count',
+    'is_favorite': 'is_favorite',
+    'is_read': 'is_read',
+    'is_hidden': 'is_hidden',
+}
+
+
+class ApiError(Exception):
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def api_view(view):
+    """
+    Turns a view into a GET-only JSON endpoint: anonymous requests get a 401 instead
+    of the login redirect, and an ApiError raised by the view becomes an error
+    response. Async views get request.user loaded already.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            request.user = await request.auser()
+            if not request.user.is_authenticated:
+                return JsonResponse({'error': 'Authentication required'}, status=401)
+            try:
+                return await view(request, *args, **kwargs)
+            except ApiError as error:
+                return JsonResponse({'error': str(error)}, status=error.status)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not request.user.is_authenticated:
+                return JsonResponse({'error': 'Authentication required'}, status=401)
+            try:
+                return view(request, *args, **kwargs)
+            except ApiError as error:
+                return JsonResponse({'error': str(error)}, status=error.status)
+
+    return require_GET(wrapper)
+
+
+def _item_fields(request):
+    names = [name.strip() for name in request.GET.get('fields', '').split(',') if name.strip()]
+    unknown = [name for name in names if name not in ITEM_FIELDS]
+    if unknown:
+        raise ApiError('Unknown fields: %s' % ', '.join(unknown))
+    return names or list(ITEM_FIELDS)
+
+
+def _items(request, names):
+    """
+    Returns the user's items for the request's listing and since filters, as dicts
+    holding only the columns asked for plus what the cursors need.
+    """
+    news = NewsItem.objects.for_user(request.user).listing(request.user, request.GET.get('listing'))
+    since = request.GET.get('since')
+    if since:
+        since = parse_since(since)
+        if since is None:
+            raise ApiError('since must be an ISO 8601 date or datetime')
+        news = news.since(since)
+    columns = {ITEM_FIELDS[name] for name in names} | {'id', 'published_at'}
+    return news.values(*columns)
+
+
+def _serialize_item(row, names):
+    return {name: row[ITEM_FIELDS[name]] for name in names}
+
+
+def _page_size(request):
+    try:
+        size = int(request.GET.get('limit', settings.NEWSFEED_PAGE_SIZE))
+    except ValueError:
+        raise ApiError('limit must be a number')
+    return max(1, min(size, settings.NEWSFEED_API_MAX_PAGE_SIZE))
+
+
+@api_view
+def items(request):
+    """
+    A page of the user's news items, newest first.
+
+    ?listing=all|favorites|unread|hidden, ?since=<ISO date> (fetched after),
+    ?fields=<comma separated names>, ?limit=<page size> and ?cursor=<next or prev
+    cursor of the previous response>.
+    """
+    names = _item_fields(request)
+    try:
+        page = paginate(_items(request, names), request.GET.get('cursor'), _page_size(request))
+    except InvalidCursor:
+        raise ApiError('Invalid cursor')
+    return JsonResponse({
+        'results': [_serialize_item(row, names) for row in page.items],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    })
+
+
+@api_view
+async def export_items(request):
+    """
+    All of the user's news items matching the same filters as items(), newest
+    first, as one JSON array. It is read a batch at a time and streamed out as it
+    goes, so memory use doesn't grow with the number of items.
+
+    The rows come from an async generator: under ASGI (uvicorn) Django would read
+    a plain generator to the end before sending anything.
+    """
+    names = _item_fields(request)
+    news = _items(request, names).order_by('-published_at', '-id')
+
+    async def rows():
+        yield '['
+        first = True
+        async for row in news.aiterator(chunk_size=settings.NEWSFEED_API_EXPORT_BATCH_SIZE):
+            yield ('' if first else ',') + json.dumps(_serialize_item(row, names), cls=DjangoJSONEncoder)
+            first = False
+        yield ']'
+
+    return StreamingHttpResponse(rows(), content_type='application/json')
+
+
+@api_view
+def search(request):
+    """
+    The user's news items matching ?q=<words>, best match first, with the same
+    ?fields= and ?limit= as items().
+    """
+    names = _item_fields(request)
+    results = search_items(request.user, request.GET.get('q', ''), _page_size(request))
+    return JsonResponse({
+        'results': [{name: getattr(item, ITEM_FIELDS[name]) for name in names} for item in results],
+    })
+
+
+@api_view
+def sources(request):
+    """
+    The user's sources.
+    """
+    results = [{
+        'id': source.pk,
+        'name': source.source_name,
+        'url': source.source_url,
+        'feed': source.feed_id,
+        'feed_title': source.feed.title,
+    } for source in SourceRSS.objects.filter(user=request.user).select_related('feed').order_by('pk')]
+    return JsonResponse({'results': results})
+
+
+@api_view
+def comments(request, news_id):
+    """
+    The comments of a news item from one of the user's feeds, oldest first,
+    ?limit=<page size> at a time from after the id given as ?after=.
+    """
+    if not NewsItem.objects.filter(pk=news_id, feed__subscriptions__user=request.user).exists():
+        raise ApiError('Not found', status=404)
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        raise ApiError('after must be a comment id')
+    size = _page_size(request)
+    rows = list(Comments.objects.filter(news_item_id=news_id, pk__gt=after).select_related('user')
+                .order_by('pk')[:size + 1])
+    results = [{
+        'id': comment.pk,
+        'user': comment.user.username,
+        'comment': comment.comment,
+        'date': comment.date,
+        'likes': comment.likes,
+    } for comment in rows[:size]]
+    return JsonResponse({
+        'results': results,
+        'next_after': results[-1]['id'] if len(rows) > size else None,
+    })
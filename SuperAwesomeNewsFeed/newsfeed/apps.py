@@ -1,5 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class NewsfeedConfig(AppConfig):
     name = 'newsfeed'
+
+    def ready(self):
+        from .search import ensure_sqlite_triggers
+        post_migrate.connect(ensure_sqlite_triggers, sender=self)
+
+        if settings.NEWSFEED_METRICS:
+            from .metrics import install_query_timer
+            connection_created.connect(install_query_timer)
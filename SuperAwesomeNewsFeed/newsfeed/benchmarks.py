@@ -0,0 +1,203 @@
+import random
+import statistics
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .feedserver import FeedServer
+from .models import Feed, SourceRSS, NewsItem, Comments
+from .normalization import entry_key
+from .rawcache import recorded_urls
+from .utils import add_news_items, rss_parser
+
+BATCH_SIZE = 1000
+
+WORDS = ('market', 'election', 'budget', 'storm', 'league', 'science', 'health', 'energy', 'court', 'travel',
+         'music', 'housing', 'climate', 'startup', 'festival', 'transport', 'museum', 'satellite')
+
+# counts of what generate_data() stored
+Generated = namedtuple('Generated', ['users', 'feeds', 'sources', 'items', 'comments'])
+
+
+def _headline(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(6)).capitalize()
+
+
+def generate_data(users, sources_per_user, items_per_feed, comments_per_item, feeds=None, prefix='synthetic',
+                  password='synthetic', seed=0):
+    """
+    Stores a synthetic data set: users named <prefix>-<n> (all with the given
+    password), each subscribing to sources_per_user of feeds feeds (as many as
+    that takes by default) holding items_per_feed items each, published a few
+    minutes apart, with comments_per_item comments by random users.
+
+    Everything is written with bulk INSERTs and the same seed gives the same data.
+    Returns the Generated counts.
+    """
+    rng = random.Random(seed)
+    feeds = feeds or users * sources_per_user
+    now = timezone.now()
+    password = make_password(password)
+
+    with transaction.atomic():
+        User.objects.bulk_create([User(username='%s-%d' % (prefix, i), password=password) for i in range(users)],
+                                 batch_size=BATCH_SIZE)
+        user_ids = list(User.objects.filter(username__startswith=prefix + '-').values_list('pk', flat=True))
+
+        Feed.objects.bulk_create([Feed(url='http://%s.example.com/feed/%d' % (prefix, i), title='Feed %d' % i)
+                                  for i in range(feeds)], batch_size=BATCH_SIZE)
+        feed_list = list(Feed.objects.filter(url__startswith='http://%s.example.com/' % prefix))
+
+        # round robin, so every feed has subscribers when there are enough sources
+        SourceRSS.objects.bulk_create([
+            SourceRSS(user_id=user_id, feed=feed, source_name=feed.title, source_url=feed.url)
+            for n, user_id in enumerate(user_ids)
+            for feed in (feed_list[(n * sources_per_user + i) % len(feed_list)] for i in range(sources_per_user))
+        ], batch_size=BATCH_SIZE)
+
+        items = 0
+        for feed in feed_list:
+            news = [NewsItem(feed=feed, title=_headline(rng), summary=' '.join(rng.choice(WORDS) for _ in range(40)),
+                             link='%s/%d' % (feed.url, i), published_at=now - timedelta(minutes=5 * i),
+                             fetched_at=now, dedup_key=entry_key(None, '%s/%d' % (feed.url, i)))
+                    for i in range(items_per_feed)]
+            NewsItem.objects.bulk_create(news, batch_size=BATCH_SIZE)
+            items += len(news)
+
+        comments = 0
+        if comments_per_item:
+            batch = []
+            for item_id in NewsItem.objects.filter(feed__in=feed_list).values_list('pk', flat=True).iterator():
+                batch.extend(Comments(news_item_id=item_id, user_id=rng.choice(user_ids),
+                                      comment=_headline(rng), likes=rng.randrange(10))
+                             for _ in range(comments_per_item))
+                if len(batch) >= BATCH_SIZE:
+                    Comments.objects.bulk_create(batch)
+                    comments += len(batch)
+                    batch = []
+            Comments.objects.bulk_create(batch)
+            comments += len(batch)
+
+    return Generated(len(user_ids), len(feed_list), len(user_ids) * sources_per_user, items, comments)
+
+
+def _summarize(timings):
+    timings = sorted(timings)
+    return {
+        'count': len(timings),
+        'mean': statistics.mean(timings),
+        'median': statistics.median(timings),
+        'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'max': timings[-1],
+    }
+
+
+def benchmark_ingest(entries=5000, batch_size=None):
+    """
+    Times add_news_items storing entries new entries into a feed of their own, and
+    then the same entries again, which are all skipped as duplicates.
+    """
+    feed = Feed.objects.create(url='http://ingest.example.com/feed/%d' % time.time_ns())
+    data = [{'title': 'Entry %d' % i, 'link': 'http://ingest.example.com/%d' % i, 'summary': 'Summary %d' % i}
+            for i in range(entries)]
+
+    start = time.perf_counter()
+    inserted = add_news_items(data, feed, batch_size).inserted
+    new = time.perf_counter() - start
+    start = time.perf_counter()
+    add_news_items(data, feed, batch_size)
+    duplicates = time.perf_counter() - start
+    return {
+        'entries': entries,
+        'inserted': inserted,
+        'seconds': new,
+        'items_per_second': entries / new,
+        'duplicate_seconds': duplicates,
+        'duplicates_per_second': entries / duplicates,
+    }
+
+
+def benchmark_refresh(feeds=20, items=200, summary_size=500, atom=False):
+    """
+    Times rss_parser refreshing feeds feeds of items entries each, served by a local
+    FeedServer: once when every entry is new and once when none is.
+    """
+    with FeedServer() as server:
+        query = '?items=%d&summary=%d%s' % (items, summary_size, '&format=atom' if atom else '')
+        pks = [Feed.objects.for_url('%s/refresh/%d/%d%s' % (server.url, time.time_ns(), i, query)).pk
+               for i in range(feeds)]
+        runs = []
+        for _ in range(2):
+            start = time.perf_counter()
+            results = rss_parser(pks)
+            runs.append((time.perf_counter() - start, results))
+    (first, results), (second, _) = runs
+    inserted = sum(result.inserted for result in results.values())
+    return {
+        'feeds': feeds,
+        'items_per_feed': items,
+        'format': 'atom' if atom else 'rss',
+        'inserted': inserted,
+        'seconds': first,
+        'items_per_second': inserted / first,
+        'unchanged_seconds': second,
+        'errors': sum(1 for result in results.values() if result.error or (result.status or 0) >= 400),
+    }
+
+
+def benchmark_replay(directory):
+    """
+    Times rss_parser storing every feed recorded in the raw response cache at
+    directory (see rawcache), replayed from there rather than downloaded.
+    """
+    pks = [Feed.objects.for_url(url).pk for url in recorded_urls(directory)]
+    with override_settings(NEWSFEED_RAW_CACHE_DIR=directory, NEWSFEED_RAW_CACHE_REPLAY=True):
+        start = time.perf_counter()
+        results = rss_parser(pks)
+        seconds = time.perf_counter() - start
+    inserted = sum(result.inserted for result in results.values())
+    return {
+        'feeds': len(pks),
+        'inserted': inserted,
+        'seconds': seconds,
+        'items_per_second': inserted / seconds if seconds else 0,
+        'errors': sum(1 for result in results.values() if result.error or (result.status or 0) >= 400),
+    }
+
+
+def benchmark_feed_page(user, requests=50, sort_by='all', cached=False):
+    """
+    Times requests GETs of user's newsfeed page and counts the queries each one
+    runs. Unless cached, the page cache is off so every request renders the page.
+    """
+    client = Client()
+    client.force_login(user)
+    url = reverse('newsfeed:newsfeed', args=[sort_by])
+    timeout = {} if cached else {'NEWSFEED_PAGE_CACHE_TIMEOUT': 0}
+    timings = []
+    queries = []
+    with override_settings(ALLOWED_HOSTS=['testserver'], **timeout):
+        cache.clear()
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError('%s answered %d' % (url, response.status_code))
+            queries.append(len(captured))
+    return {
+        'requests': requests,
+        'cached': cached,
+        'seconds': _summarize(timings),
+        'queries': {'min': min(queries), 'max': max(queries), 'mean': statistics.mean(queries)},
+    }
@@ -0,0 +1,117 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from .models import SourceRSS
+
+VERSION_KEY = 'newsfeed:version:%d'
+PAGE_KEY = 'newsfeed:page:%s:%d:%d:%s:%s'
+
+
+def user_version(user_id):
+    """
+    Returns the current version of everything user_id sees. Cached pages are keyed
+    by it, so bumping it drops all of the user's pages at once.
+    """
+    version = cache.get(VERSION_KEY % user_id)
+    if version is None:
+        # start from the clock so a version key evicted from the cache can't come back
+        # with a number that old pages were stored under
+        version = int(time.time() * 1000)
+        cache.add(VERSION_KEY % user_id, version, None)
+        version = cache.get(VERSION_KEY % user_id, version)
+    return version
+
+
+def invalidate_users(user_ids):
+    """
+    Drops the cached pages of the given users.
+    """
+    for user_id in set(user_ids):
+        try:
+            cache.incr(VERSION_KEY % user_id)
+        except ValueError:
+            # no version yet, so nothing cached either
+            pass
+
+
+def invalidate_feed(feed):
+    """
+    Drops the cached pages of everyone subscribed to feed, e.g. after new items
+    were stored or an item's comments changed.
+    """
+    invalidate_users(SourceRSS.objects.filter(feed=feed).values_list('user_id', flat=True))
+
+
+def _shared_cache():
+    # the versions are bumped by other processes too (refresh_feeds), which a cache
+    # private to this one never hears of
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def cached_page(view=None, forms=False, etag_func=None):
+    """
+    Caches the GET responses of a view for the logged in user, by url (so by page and
+    filter) and user version, for NEWSFEED_PAGE_CACHE_TIMEOUT seconds. Nothing is
+    cached in a LocMemCache, see _shared_cache().
+
+    Pages with forms (forms=True) carry the user's CSRF token, so they are also keyed
+    by the CSRF cookie and aren't cached until the browser has one.
+
+    Views sending an ETag pass its etag_func, and their pages are keyed by it too:
+    a change the user version missed (e.g. bumped in another process's cache) can't
+    serve an old page under a new ETag.
+
+    Works on sync and async views alike.
+    """
+    if view is None:
+        return lambda view: cached_page(view, forms, etag_func)
+
+    def page_key(request, user, *args, **kwargs):
+        # None when the response shouldn't be cached
+        if request.method != 'GET' or not settings.NEWSFEED_PAGE_CACHE_TIMEOUT or not _shared_cache():
+            return None
+        url = request.get_full_path()
+        if forms:
+            csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+            if csrf_cookie is None:
+                return None
+            url += '|' + csrf_cookie
+
+        url = hashlib.md5(url.encode('utf-8')).hexdigest()
+        etag = etag_func(request, *args, **kwargs) if etag_func else ''
+        return PAGE_KEY % (view.__name__, user.pk, user_version(user.pk), etag, url)
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            key = await sync_to_async(page_key)(request, await request.auser(), *args, **kwargs)
+            if key is None:
+                return await view(request, *args, **kwargs)
+            response = await cache.aget(key)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    await cache.aset(key, response, settings.NEWSFEED_PAGE_CACHE_TIMEOUT)
+            return response
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = page_key(request, request.user, *args, **kwargs)
+        if key is None:
+            return view(request, *args, **kwargs)
+        response = cache.get(key)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response, settings.NEWSFEED_PAGE_CACHE_TIMEOUT)
+        return response
+
+    return wrapper
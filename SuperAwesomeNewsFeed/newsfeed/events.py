@@ -0,0 +1,306 @@
+import asyncio
+import json
+import re
+import weakref
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Comments, Event
+
+# how many events a client may fall behind before it is disconnected (it reconnects
+# with Last-Event-ID and catches up from the table)
+QUEUE_SIZE = 1000
+
+# sent instead of an event to tell a client it fell behind
+OVERFLOW = object()
+
+# most ids a Cursor looks for again: more than transactions still in flight could
+# explain, and each is sent along with every event and queried for on every poll
+MAX_MISSING = 100
+
+# what a Cursor looks like as a Last-Event-ID: "<last id>" or "<last id>:<id>,<id>,..."
+CURSOR_RE = re.compile(r'\d{1,18}(:\d{1,18}(,\d{1,18}){0,%d})?' % (MAX_MISSING - 1))
+
+
+def publish(kind, feed_id, payload):
+    """
+    Records an event for the subscribers of a feed, see Event.
+    """
+    Event.objects.create(kind=kind, feed_id=feed_id, payload=json.dumps(payload, cls=DjangoJSONEncoder))
+
+
+def publish_items(news_items):
+    """
+    Records a new item event for each of the given freshly stored NewsItems, with a
+    single INSERT.
+    """
+    Event.objects.bulk_create(Event(kind=Event.ITEM, feed_id=item.feed_id, payload=json.dumps({
+        'id': item.pk,
+        'feed': item.feed_id,
+        'title': item.title,
+        'summary': item.summary,
+        'link': item.link,
+        'published_at': item.published_at,
+    }, cls=DjangoJSONEncoder)) for item in news_items if item.pk is not None)
+
+
+def publish_comment_count(news_item):
+    publish(Event.COMMENT, news_item.feed_id, {
+        'item': news_item.pk,
+        'comment_count': Comments.objects.filter(news_item=news_item).count(),
+    })
+
+
+def publish_likes(comment_pks):
+    """
+    Records the current like count of each of the given comments.
+    """
+    rows = Comments.objects.filter(pk__in=comment_pks).values_list('pk', 'news_item_id', 'news_item__feed_id',
+                                                                  'likes')
+    Event.objects.bulk_create(Event(kind=Event.LIKE, feed_id=feed_id, payload=json.dumps({
+        'comment': pk, 'item': item_id, 'likes': likes,
+    })) for pk, item_id, feed_id, likes in rows)
+
+
+def prune_events(now=None):
+    """
+    Deletes the events older than NEWSFEED_EVENTS_RETENTION seconds. Returns the
+    number deleted.
+    """
+    now = now or timezone.now()
+    deleted, _ = Event.objects.filter(created__lt=now - timedelta(seconds=settings.NEWSFEED_EVENTS_RETENTION)).delete()
+    return deleted
+
+
+def format_event(event, cursor=None):
+    """
+    Returns event as a message of the text/event-stream format, with cursor as its
+    id if given, or else the event's id.
+    """
+    return 'id: %s\nevent: %s\ndata: %s\n\n' % (event.pk if cursor is None else cursor, event.kind, event.payload)
+
+
+class Cursor:
+    """
+    How far through the Event table a reader is: every id up to last_id but the ones
+    in missing.
+
+    Event ids come from a sequence, and a transaction that took an id may commit
+    after one that took a later id. So the ids a reader skips over are kept as
+    missing, and looked for again, until NEWSFEED_EVENTS_COMMIT_GRACE seconds after
+    the event they were skipped for was created. Only the ids between two events
+    the cursor read are known to be skipped, and when more than MAX_MISSING are
+    missing it stops looking for any of them.
+
+    str() of a cursor is the id sent with an event, which a reconnecting browser
+    sends back as Last-Event-ID for parse().
+    """
+
+    def __init__(self, last_id, missing=(), read=True):
+        self.last_id = last_id
+        self.missing = dict.fromkeys(missing, timezone.now() + timedelta(seconds=settings.NEWSFEED_EVENTS_COMMIT_GRACE))
+        # whether this cursor read the event last_id itself: the ids between one a
+        # client came back with and the next can be long gone rather than skipped
+        self.read = read
+
+    @classmethod
+    def parse(cls, value):
+        """
+        Returns the Cursor str() gave value for, or None if it isn't one. Plain event
+        ids are cursors with nothing missing.
+        """
+        value = str(value)
+        if not CURSOR_RE.fullmatch(value):
+            return None
+        last_id, _, missing = value.partition(':')
+        return cls(int(last_id), [int(pk) for pk in missing.split(',') if pk], read=False)
+
+    def __str__(self):
+        if not self.missing:
+            return str(self.last_id)
+        return '%d:%s' % (self.last_id, ','.join(str(pk) for pk in sorted(self.missing)))
+
+    def copy(self):
+        cursor = Cursor(self.last_id, read=self.read)
+        cursor.missing = dict(self.missing)
+        return cursor
+
+    def has(self, pk):
+        """
+        Whether the reader is past the event with id pk.
+        """
+        return pk <= self.last_id and pk not in self.missing
+
+    def advance(self, event):
+        """
+        Moves the cursor past event.
+        """
+        if event.pk > self.last_id:
+            # the ids skipped were taken before event was created, so from long ago
+            # they are pruned or rolled back events, not ones yet to commit
+            deadline = event.created + timedelta(seconds=settings.NEWSFEED_EVENTS_COMMIT_GRACE)
+            if self.read and deadline > timezone.now():
+                self.look_for(range(self.last_id + 1, event.pk), deadline)
+            self.last_id = event.pk
+            self.read = True
+        else:
+            self.missing.pop(event.pk, None)
+
+    def look_for(self, ids, deadline):
+        """
+        Adds ids to the missing ones until deadline, or gives up on all of them when
+        that makes more than MAX_MISSING.
+        """
+        ids = [pk for pk in ids if pk not in self.missing]
+        if len(self.missing) + len(ids) > MAX_MISSING:
+            self.missing = {}
+        else:
+            self.missing.update(dict.fromkeys(ids, deadline))
+
+    def expire(self):
+        """
+        Stops looking for the missing ids that didn't turn up in time, most likely
+        rolled back.
+        """
+        now = timezone.now()
+        self.missing = {pk: deadline for pk, deadline in self.missing.items() if deadline > now}
+
+    def unread(self):
+        """
+        Returns the events after the cursor, in id order.
+        """
+        return Event.objects.filter(Q(pk__gt=self.last_id) | Q(pk__in=list(self.missing))).order_by('pk')
+
+
+class EventBroker:
+    """
+    Fans the events stored in the database out to the clients of this process.
+
+    A single task polls the Event table every NEWSFEED_EVENTS_POLL_INTERVAL seconds
+    for as long as anyone is listening, however many clients that is, and hands each
+    event to every client's queue, once, including the ones that commit after
+    events with later ids (see Cursor).
+    """
+
+    def __init__(self):
+        self.queues = set()
+        self.cursor = None
+        # where the cursor started, this broker never looked for the ids before it
+        self.first_id = None
+        self.task = None
+
+    async def subscribe(self):
+        """
+        Returns a new client queue, which gets the events after self.cursor as it
+        is when this returns.
+        """
+        if self.task is None or self.task.done():
+            # nobody was listening, so start from the events to come
+            latest = await Event.objects.order_by('-pk').afirst()
+            if self.task is None or self.task.done():
+                self.first_id = latest.pk if latest else 0
+                self.cursor = Cursor(self.first_id)
+                self.task = asyncio.ensure_future(self.run())
+        queue = asyncio.Queue(QUEUE_SIZE)
+        self.queues.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.queues.discard(queue)
+
+    def expect(self, ids):
+        """
+        Looks for the given ids too, missing from a reconnecting client's cursor,
+        if they are from before this broker started. They only take the room left,
+        so no client can make the broker give up on the ids it's looking for.
+        """
+        deadline = timezone.now() + timedelta(seconds=settings.NEWSFEED_EVENTS_COMMIT_GRACE)
+        ids = [pk for pk in ids if pk <= self.first_id and pk not in self.cursor.missing]
+        self.cursor.look_for(ids[:max(MAX_MISSING - len(self.cursor.missing), 0)], deadline)
+
+    async def run(self):
+        while self.queues:
+            self.cursor.expire()
+            events = [event async for event in self.cursor.unread()]
+            for event in events:
+                self.cursor.advance(event)
+                for queue in list(self.queues):
+                    if queue.full():
+                        self.queues.discard(queue)
+                        queue.get_nowait()
+                        queue.put_nowait(OVERFLOW)
+                    else:
+                        queue.put_nowait(event)
+            await asyncio.sleep(settings.NEWSFEED_EVENTS_POLL_INTERVAL)
+
+
+# one broker per event loop, under ASGI that's the whole process (tests run each
+# async test in a loop of its own)
+_brokers = weakref.WeakKeyDictionary()
+
+
+def can_stream(request):
+    """
+    Whether request is served over ASGI, the only way the event stream can be.
+    Under WSGI Django reads an async response to the end before sending any of
+    it, which for a stream that never ends ties up the worker for good.
+    """
+    return isinstance(request, ASGIRequest)
+
+
+def get_broker():
+    loop = asyncio.get_running_loop()
+    if loop not in _brokers:
+        _brokers[loop] = EventBroker()
+    return _brokers[loop]
+
+
+async def stream_events(feed_ids, last_event_id=None):
+    """
+    Yields the events of the given feeds as text/event-stream messages, starting
+    after last_event_id, a Cursor sent with an earlier event (replayed from the
+    table), or with the events to come if it's None. A comment line is sent every
+    NEWSFEED_EVENTS_HEARTBEAT seconds without events so proxies don't drop the
+    connection.
+
+    Events are sent with the stream's cursor as their id, and each only once, as
+    they may come both from the backlog and from the broker.
+    """
+    feed_ids = set(feed_ids)
+    broker = get_broker()
+    # subscribe before reading the backlog so nothing falls in between
+    queue = await broker.subscribe()
+    cursor = Cursor.parse(last_event_id) if last_event_id is not None else None
+    try:
+        if cursor is None:
+            cursor = broker.cursor.copy()
+        else:
+            broker.expect(cursor.missing)
+            # of all feeds, so the ids of other feeds' events aren't taken for missing ones
+            async for event in cursor.unread():
+                cursor.advance(event)
+                if event.feed_id in feed_ids:
+                    yield format_event(event, cursor)
+        yield 'retry: %d\n\n' % (settings.NEWSFEED_EVENTS_RETRY * 1000)
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), settings.NEWSFEED_EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if event is OVERFLOW:
+                return
+            if cursor.has(event.pk):
+                continue
+            cursor.expire()
+            cursor.advance(event)
+            if event.feed_id in feed_ids:
+                yield format_event(event, cursor)
+    finally:
+        broker.unsubscribe(queue)
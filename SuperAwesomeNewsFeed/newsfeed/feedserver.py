@@ -0,0 +1,125 @@
+import base64
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+
+class FeedServer:
+    """
+    Local stand-in for remote RSS servers, serving a generated feed on any path, for
+    the tests and the benchmark command.
+
+    ?items=<count> sets the number of items (3 by default), ?summary=<bytes> pads
+    their summaries to about that size and ?format=atom serves Atom instead of RSS.
+    ?delay=<seconds> makes the response slow and ?status=<code> makes it fail.
+    ?etag=<tag> and ?modified=1 add validators and answer matching conditional requests
+    with 304. ?auth=<user>:<password> answers 401 to requests without those Basic
+    credentials. Any other parameter is sent back as a response header (e.g.
+    ?Cache-Control=...).
+    """
+
+    LAST_MODIFIED = 'Wed, 18 Apr 2018 10:00:00 GMT'
+
+    class HTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.hits = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.serve(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = self.HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_port
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def serve(self, handler):
+        url = urlsplit(handler.path)
+        query = parse_qs(url.query)
+        with self.lock:
+            self.hits += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(float(query.pop('delay', ['0'])[0]))
+            status = int(query.pop('status', ['200'])[0])
+            count = int(query.pop('items', ['3'])[0])
+            summary_size = int(query.pop('summary', ['0'])[0])
+            atom = query.pop('format', ['rss'])[0] == 'atom'
+            auth = query.pop('auth', [None])[0]
+            if auth is not None and handler.headers.get('Authorization') != \
+                    'Basic ' + base64.b64encode(auth.encode('utf-8')).decode('ascii'):
+                status = 401
+            headers = {name: values[0] for name, values in query.items()}
+            if 'etag' in headers:
+                headers['ETag'] = '"%s"' % headers.pop('etag')
+                if handler.headers.get('If-None-Match') == headers['ETag']:
+                    status = 304
+            if headers.pop('modified', None):
+                headers['Last-Modified'] = self.LAST_MODIFIED
+                if handler.headers.get('If-Modified-Since') == self.LAST_MODIFIED:
+                    status = 304
+
+            body = b''
+            if status != 304:
+                body = (self.atom if atom else self.rss)(url.path, count, summary_size).encode('utf-8')
+            handler.send_response(status)
+            handler.send_header('Content-Type', 'application/%s+xml; charset=utf-8' % ('atom' if atom else 'rss'))
+            handler.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                handler.send_header(name, value)
+            handler.end_headers()
+            handler.wfile.write(body)
+        except ConnectionError:
+            # the client gave up waiting (timeout tests)
+            pass
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    @staticmethod
+    def _summary(i, size):
+        summary = 'Summary %d' % i
+        return summary + ' lorem ipsum' * max(0, (size - len(summary)) // 12)
+
+    @classmethod
+    def rss(cls, name, count=3, summary_size=0):
+        name = escape(name)
+        items = ''.join('<item><title>%s item %d</title><link>http://example.com%s/%d</link>'
+                        '<description>%s</description></item>' % (name, i, name, i, cls._summary(i, summary_size))
+                        for i in range(count))
+        return '<?xml version="1.0"?><rss version="2.0"><channel><title>%s</title>%s</channel></rss>' % (name, items)
+
+    @classmethod
+    def atom(cls, name, count=3, summary_size=0):
+        name = escape(name)
+        entries = ''.join('<entry><title>%s item %d</title><id>urn:example%s:%d</id>'
+                          '<link href="http://example.com%s/%d"/><updated>2018-04-18T10:00:00Z</updated>'
+                          '<summary>%s</summary></entry>' % (name, i, name, i, name, i, cls._summary(i, summary_size))
+                          for i in range(count))
+        return ('<?xml version="1.0" encoding="utf-8"?><feed xmlns="http://www.w3.org/2005/Atom">'
+                '<title>%s</title>%s</feed>' % (name, entries))
@@ -0,0 +1,205 @@
+import base64
+import os
+import time
+import zlib
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta, timezone
+from email.utils import parsedate_to_datetime
+from urllib.error import HTTPError
+from urllib.parse import unquote, urlsplit, urlunsplit
+from urllib.request import Request, pathname2url, urlopen
+
+from django.conf import settings
+
+USER_AGENT = 'SuperAwesomeNewsFeed/1.0 (+https://github.com/Catbip/SuperAwesomeNewsFeed)'
+
+CHUNK_SIZE = 64 * 1024
+
+# key is whatever the caller uses to match a result back to its request (e.g. a SourceRSS.pk)
+FeedRequest = namedtuple('FeedRequest', ['key', 'url', 'headers'])
+# truncated is True when the body was cut off at NEWSFEED_FETCH_MAX_BYTES
+FeedResponse = namedtuple('FeedResponse', ['key', 'url', 'status', 'headers', 'body', 'error', 'elapsed',
+                                           'truncated'], defaults=[False])
+
+
+class FetchTimeout(Exception):
+    pass
+
+
+def fetch_feed(request, timeout, max_bytes=None):
+    """
+    Downloads a single feed and returns a FeedResponse.
+
+    The timeout covers the whole request, not just each socket read, so a server that
+    drips the body out slowly can't hold a worker forever. Errors are returned in the
+    response instead of being raised so one broken feed doesn't affect the others.
+
+    Bodies are cut off at max_bytes (NEWSFEED_FETCH_MAX_BYTES by default), before and
+    after decompression, and the response is marked truncated.
+
+    A user name and password in the url are sent as HTTP Basic credentials.
+    """
+    max_bytes = max_bytes or settings.NEWSFEED_FETCH_MAX_BYTES
+    url = request.url
+    parts = urlsplit(url)
+    if url and not parts.scheme:
+        # plain paths are read from disk, like feedparser.parse does
+        url = 'file:' + pathname2url(os.path.abspath(url))
+
+    headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'}
+    if parts.username is not None:
+        # urllib would take them for part of the host
+        credentials = '%s:%s' % (unquote(parts.username), unquote(parts.password or ''))
+        headers['Authorization'] = 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+        url = urlunsplit(parts._replace(netloc=parts.netloc.rpartition('@')[2]))
+    headers.update(request.headers or {})
+
+    start = time.monotonic()
+    deadline = start + timeout
+    try:
+        try:
+            response = urlopen(Request(url, headers=headers), timeout=timeout)
+        except HTTPError as error:
+            # 304 Not Modified and error statuses end up here, their body isn't needed
+            return FeedResponse(request.key, request.url, error.code, _lower_keys(error.headers), b'', None,
+                                time.monotonic() - start)
+        with response:
+            chunks = []
+            size = 0
+            truncated = False
+            while True:
+                if time.monotonic() > deadline:
+                    raise FetchTimeout('Timed out after %s seconds' % timeout)
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > max_bytes:
+                    truncated = True
+                    break
+            response_headers = _lower_keys(response.headers)
+            body = b''.join(chunks)[:max_bytes]
+            body = _decode_body(body, response_headers.get('content-encoding'), max_bytes)
+            truncated = truncated or len(body) >= max_bytes
+            status = response.getcode() or 200
+    except Exception as error:
+        return FeedResponse(request.key, request.url, None, {}, b'', error, time.monotonic() - start)
+
+    return FeedResponse(request.key, request.url, status, response_headers, body, None, time.monotonic() - start,
+                        truncated)
+
+
+def fetch_feeds(requests, max_workers=None, per_host=None, timeout=None):
+    """
+    Downloads many feeds at once and yields a FeedResponse for each as soon as it
+    finishes, so the caller can parse and store one feed while others are still
+    downloading.
+
+    At most max_workers downloads run at the same time, and at most per_host of them
+    against the same host. Defaults come from the NEWSFEED_FETCH_* settings.
+    """
+    max_workers = max_workers or settings.NEWSFEED_FETCH_WORKERS
+    per_host = per_host or settings.NEWSFEED_FETCH_PER_HOST
+    timeout = timeout or settings.NEWSFEED_FETCH_TIMEOUT
+
+    pending = OrderedDict()
+    for request in requests:
+        pending.setdefault(urlsplit(request.url).hostname, deque()).append(request)
+
+    running = Counter()
+    futures = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+
+        def submit_ready():
+            # hand out free workers one host at a time so a single big host can't take them all
+            submitted = True
+            while submitted and len(futures) < max_workers:
+                submitted = False
+                for host, queue in pending.items():
+                    if queue and running[host] < per_host and len(futures) < max_workers:
+                        futures[pool.submit(fetch_feed, queue.popleft(), timeout)] = host
+                        running[host] += 1
+                        submitted = True
+
+        submit_ready()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                running[futures.pop(future)] -= 1
+            submit_ready()
+            for future in done:
+                yield future.result()
+
+
+def poll_not_before(headers, now):
+    """
+    Returns the earliest time the server wants the feed fetched again, going by the
+    Retry-After, Cache-Control max-age and Expires headers of its response, or None
+    if it didn't say.
+    """
+    retry_after = _parse_delay(headers.get('retry-after'), now)
+    if retry_after is not None:
+        return retry_after
+
+    directives = {}
+    for directive in headers.get('cache-control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name.lower()] = value.strip('"')
+    if 'no-store' in directives or 'no-cache' in directives:
+        return None
+    if 'max-age' in directives:
+        try:
+            age = int(headers.get('age', 0))
+            return now + timedelta(seconds=int(directives['max-age']) - age)
+        except ValueError:
+            return None
+
+    expires = _parse_http_date(headers.get('expires'))
+    if expires is not None:
+        # measure the lifetime against the server's clock rather than ours
+        date = _parse_http_date(headers.get('date')) or now
+        return now + (expires - date)
+    return None
+
+
+def _parse_delay(value, now):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return now + timedelta(seconds=int(value))
+    return _parse_http_date(value)
+
+
+def _parse_http_date(value):
+    if not value:
+        return None
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date
+
+
+def _lower_keys(headers):
+    if headers is None:
+        return {}
+    return {key.lower(): value for key, value in headers.items()}
+
+
+def _decode_body(body, encoding, max_bytes):
+    # at most max_bytes of output, and a body cut off mid-stream gives what could be read
+    if encoding == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(body, max_bytes)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompressobj().decompress(body, max_bytes)
+        except zlib.error:
+            # some servers send raw deflate data without the zlib header
+            return zlib.decompressobj(-zlib.MAX_WBITS).decompress(body, max_bytes)
+    return body[:max_bytes]
@@ -0,0 +1,92 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Count, DateTimeField, Max, OuterRef, Subquery, Sum
+from django.views.decorators.http import condition
+
+from .models import SourceRSS, NewsItem, ItemState, Comments
+
+
+def _feed_state(request):
+    """
+    Returns what the newsfeed pages of the logged in user are built from, boiled
+    down to a handful of values fetched with a single query: the newest item and
+    comment of their feeds, and how many marks and subscriptions they have and
+    when those last changed.
+    """
+    if not hasattr(request, '_newsfeed_state'):
+        feeds = SourceRSS.objects.filter(user=request.user).values('feed')
+        items = NewsItem.objects.filter(feed__in=feeds)
+        states = ItemState.objects.filter(user=OuterRef('pk')).order_by().values('user')
+        subscriptions = SourceRSS.objects.filter(user=OuterRef('pk')).order_by().values('user')
+        request._newsfeed_state = User.objects.filter(pk=request.user.pk).annotate(
+            latest_item=Subquery(items.order_by('-id').values('id')[:1]),
+            latest_fetch=Subquery(items.order_by('-fetched_at').values('fetched_at')[:1]),
+            latest_comment=Subquery(Comments.objects.filter(news_item__feed__in=feeds).order_by('-id')
+                                    .values('id')[:1]),
+            states=Subquery(states.annotate(count=Count('pk')).values('count')),
+            states_changed=Subquery(states.annotate(changed=Max('updated_at')).values('changed'),
+                                    output_field=DateTimeField()),
+            subscriptions=Subquery(subscriptions.annotate(count=Count('pk')).values('count')),
+            latest_subscription=Subquery(subscriptions.annotate(latest=Max('pk')).values('latest')),
+        ).values('pk', 'latest_item', 'latest_fetch', 'latest_comment', 'states', 'states_changed',
+                 'subscriptions', 'latest_subscription').get()
+    return request._newsfeed_state
+
+
+def _etag(*values):
+    return hashlib.md5(repr(values).encode('utf-8')).hexdigest()
+
+
+def feed_etag(request, *args, **kwargs):
+    """
+    ETag of the newsfeed pages, it changes whenever anything shown on them does.
+
+    The pages get no Last-Modified: removing a mark or a subscription deletes its
+    row and leaves no time behind, so a client revalidating with If-Modified-Since
+    alone would keep a stale page.
+    """
+    state = _feed_state(request)
+    return _etag(*(state[name] for name in sorted(state)))
+
+
+def comments_etag(request, news_id, *args, **kwargs):
+    """
+    ETag of an item's comments page, from its comments and their likes. The page holds
+    a form, so it also changes with the CSRF cookie.
+    """
+    if not hasattr(request, '_comments_etag'):
+        state = Comments.objects.filter(news_item_id=news_id).aggregate(
+            count=Count('pk'), latest=Max('pk'), likes=Sum('likes'))
+        request._comments_etag = _etag(request.user.pk, news_id, state['count'], state['latest'], state['likes'],
+                                       request.COOKIES.get(settings.CSRF_COOKIE_NAME))
+    return request._comments_etag
+
+
+def async_condition(etag_func=None, last_modified_func=None):
+    """
+    Django's condition() for async views. It calls etag_func and last_modified_func
+    on the event loop, where they can't query the database, so here they are run
+    in a thread first and condition() is handed their results.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            # the user login_required already loaded, so the thread doesn't look it up again
+            request.user = await request.auser()
+
+            def validators():
+                return (etag_func(request, *args, **kwargs) if etag_func else None,
+                        last_modified_func(request, *args, **kwargs) if last_modified_func else None)
+
+            etag, last_modified = await sync_to_async(validators)()
+            conditional = condition(etag_func=lambda *args, **kwargs: etag,
+                                    last_modified_func=lambda *args, **kwargs: last_modified)(view)
+            return await conditional(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
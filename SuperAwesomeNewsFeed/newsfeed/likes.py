@@ -0,0 +1,106 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from .cache import invalidate_feed, invalidate_users
+from .events import publish_likes
+from .models import CommentLike, Comments, SourceRSS
+
+logger = logging.getLogger(__name__)
+
+# like counts not written yet in write-behind mode, by comment pk
+_pending = Counter()
+_pending_since = None
+# flushes the buffer NEWSFEED_LIKES_FLUSH_INTERVAL seconds after its first like
+_timer = None
+_lock = threading.Lock()
+
+
+def like(user, comment):
+    """
+    Records that user likes comment and adds one to its like count. Returns False
+    if user had already liked it.
+
+    The count is raised with a single UPDATE likes = likes + 1, so concurrent likes
+    can't overwrite each other. With NEWSFEED_LIKES_WRITE_BEHIND the increments are
+    collected in memory instead and written by flush_likes(), which also drops the
+    cached pages showing the counts then.
+    """
+    try:
+        with transaction.atomic():
+            CommentLike.objects.create(user=user, comment=comment)
+    except IntegrityError:
+        return False
+
+    if settings.NEWSFEED_LIKES_WRITE_BEHIND:
+        _buffer_like(comment.pk)
+    else:
+        Comments.objects.filter(pk=comment.pk).update(likes=F('likes') + 1)
+        invalidate_feed(comment.news_item.feed_id)
+        publish_likes([comment.pk])
+    return True
+
+
+def _buffer_like(comment_pk):
+    global _pending_since, _timer
+    with _lock:
+        _pending[comment_pk] += 1
+        if _pending_since is None:
+            _pending_since = time.monotonic()
+            # so the likes get written in time even if no other like comes in
+            _timer = threading.Timer(settings.NEWSFEED_LIKES_FLUSH_INTERVAL, _flush_on_timer)
+            _timer.daemon = True
+            _timer.start()
+        due = (sum(_pending.values()) >= settings.NEWSFEED_LIKES_FLUSH_SIZE or
+               time.monotonic() - _pending_since >= settings.NEWSFEED_LIKES_FLUSH_INTERVAL)
+    if due:
+        flush_likes()
+
+
+def _flush_on_timer():
+    try:
+        flush_likes()
+    except Exception:
+        logger.exception('Writing the buffered like counts failed')
+    finally:
+        # the timer thread has its own connection, which nothing else would close
+        connection.close()
+
+
+def flush_likes():
+    """
+    Writes the like counts buffered in this process to the database, with one UPDATE
+    per distinct increment rather than one per comment. Returns the number of likes
+    written.
+    """
+    global _pending_since, _timer
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _pending_since = None
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+    if not pending:
+        return 0
+
+    by_increment = defaultdict(list)
+    for comment_pk, increment in pending.items():
+        by_increment[increment].append(comment_pk)
+    with transaction.atomic():
+        for increment, comment_pks in by_increment.items():
+            Comments.objects.filter(pk__in=comment_pks).update(likes=F('likes') + increment)
+    invalidate_users(SourceRSS.objects.filter(feed__newsitem__comments__in=list(pending))
+                     .values_list('user_id', flat=True))
+    publish_likes(list(pending))
+    return sum(pending.values())
+
+
+# don't drop what's buffered when the process exits normally
+atexit.register(flush_likes)
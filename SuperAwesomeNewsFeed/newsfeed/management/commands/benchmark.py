@@ -0,0 +1,121 @@
+import json
+import os
+import platform
+import tempfile
+import time
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+
+from newsfeed.benchmarks import (benchmark_feed_page, benchmark_ingest, benchmark_refresh, benchmark_replay,
+                                 generate_data)
+
+# the benchmark's own cache, so it neither reads nor clears the site's
+BENCHMARK_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                'LOCATION': 'newsfeed-benchmark'}}
+
+
+class Command(BaseCommand):
+    help = ('Measures ingest throughput, refresh wall time and newsfeed page latency and query counts on '
+            'synthetic data in a throwaway test database, and writes the results as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='File the JSON results are written to, standard output by default.')
+        parser.add_argument('--label', default='',
+                            help='Stored with the results to tell runs apart, e.g. a release or commit.')
+        parser.add_argument('--users', type=int, default=50,
+                            help='Number of synthetic users.')
+        parser.add_argument('--sources-per-user', type=int, default=10,
+                            help='Number of sources each user subscribes to.')
+        parser.add_argument('--feeds', type=int, default=None,
+                            help='Number of feeds the sources are spread over, users * sources-per-user by default.')
+        parser.add_argument('--items-per-feed', type=int, default=200,
+                            help='Number of news items stored in each feed.')
+        parser.add_argument('--comments-per-item', type=int, default=1,
+                            help='Number of comments on each news item.')
+        parser.add_argument('--ingest-entries', type=int, default=5000,
+                            help='Number of entries stored by the ingest benchmark.')
+        parser.add_argument('--refresh-feeds', type=int, default=20,
+                            help='Number of feeds served by the local feed server and refreshed.')
+        parser.add_argument('--refresh-items', type=int, default=200,
+                            help='Number of entries in each served feed.')
+        parser.add_argument('--refresh-summary-size', type=int, default=500,
+                            help='Approximate size in bytes of the summary of each served entry.')
+        parser.add_argument('--atom', action='store_true', help='Serve Atom feeds instead of RSS.')
+        parser.add_argument('--replay', metavar='DIRECTORY',
+                            help='Also time storing the feeds recorded in this raw response cache directory '
+                                 '(see NEWSFEED_RAW_CACHE_DIR).')
+        parser.add_argument('--page-requests', type=int, default=50,
+                            help='Number of newsfeed page requests timed.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed of the data generator, the same seed gives the same data.')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        parameters = {name: value for name, value in options.items()
+                      if name not in ('output', 'label', 'verbosity', 'settings', 'pythonpath', 'traceback',
+                                      'no_color', 'force_color', 'skip_checks', 'stdout', 'stderr')}
+        report = {
+            'label': options['label'],
+            'started_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'parameters': parameters,
+            'results': {},
+        }
+
+        test_settings = connection.settings_dict['TEST']
+        test_name = test_settings['NAME']
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES=BENCHMARK_CACHES):
+            if connection.vendor == 'sqlite' and not test_name:
+                # on disk rather than the in-memory test database, to measure what the site sees
+                test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                report['results'] = self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                test_settings['NAME'] = test_name
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run(self, options):
+        results = {}
+
+        self.log('Generating data')
+        start = time.perf_counter()
+        generated = generate_data(options['users'], options['sources_per_user'], options['items_per_feed'],
+                                  options['comments_per_item'], feeds=options['feeds'], seed=options['seed'])
+        results['generate'] = dict(generated._asdict(), seconds=time.perf_counter() - start)
+
+        self.log('Ingesting %d entries' % options['ingest_entries'])
+        results['ingest'] = benchmark_ingest(options['ingest_entries'])
+
+        self.log('Refreshing %d feeds' % options['refresh_feeds'])
+        results['refresh'] = benchmark_refresh(options['refresh_feeds'], options['refresh_items'],
+                                               options['refresh_summary_size'], options['atom'])
+
+        if options['replay']:
+            self.log('Replaying the feeds recorded in %s' % options['replay'])
+            results['replay'] = benchmark_replay(options['replay'])
+
+        self.log('Requesting the newsfeed page %d times' % options['page_requests'])
+        user = User.objects.filter(username__startswith='synthetic-').order_by('pk').first()
+        results['feed_page'] = benchmark_feed_page(user, options['page_requests'])
+        results['feed_page_cached'] = benchmark_feed_page(user, options['page_requests'], cached=True)
+        return results
+
+    def log(self, message):
+        # on stderr, stdout may be the JSON
+        if self.verbosity > 0:
+            self.stderr.write(message)
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+from newsfeed.benchmarks import generate_data
+
+
+class Command(BaseCommand):
+    help = 'Stores synthetic users, subscriptions, news items and comments, e.g. to try out or profile the site.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100,
+                            help='Number of users, named <prefix>-<n>.')
+        parser.add_argument('--sources-per-user', type=int, default=10,
+                            help='Number of sources each user subscribes to.')
+        parser.add_argument('--feeds', type=int, default=None,
+                            help='Number of feeds the sources are spread over, users * sources-per-user by default.')
+        parser.add_argument('--items-per-feed', type=int, default=100,
+                            help='Number of news items in each feed.')
+        parser.add_argument('--comments-per-item', type=int, default=2,
+                            help='Number of comments on each news item.')
+        parser.add_argument('--prefix', default='synthetic',
+                            help='Prefix of the usernames and feed hosts.')
+        parser.add_argument('--password', default='synthetic',
+                            help='Password of every generated user.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed of the random generator, the same seed gives the same data.')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=options['prefix'] + '-').exists():
+            raise CommandError('There are users named %s-<n> already, choose another --prefix.' % options['prefix'])
+        generated = generate_data(options['users'], options['sources_per_user'], options['items_per_feed'],
+                                  options['comments_per_item'], feeds=options['feeds'], prefix=options['prefix'],
+                                  password=options['password'], seed=options['seed'])
+        if options['verbosity'] > 0:
+            self.stdout.write('Stored %d users, %d feeds, %d sources, %d news items and %d comments' % generated)
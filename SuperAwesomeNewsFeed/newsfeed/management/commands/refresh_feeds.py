@@ -0,0 +1,52 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from newsfeed import metrics
+from newsfeed.events import prune_events
+from newsfeed.scheduler import refresh_due_feeds
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Polls the subscribed feeds that are due and stores their new items. Any number of refreshers '
+            'can run side by side, on any number of machines, each one claims the feeds it polls.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Poll the due feeds a single time and exit.')
+        parser.add_argument('--sleep', type=float, default=settings.NEWSFEED_REFRESH_SLEEP,
+                            help='Seconds to wait between scans for due feeds.')
+        parser.add_argument('--batch-size', type=int, default=settings.NEWSFEED_REFRESH_BATCH_SIZE,
+                            help='Maximum number of feeds polled per scan.')
+        parser.add_argument('--metrics-port', type=int, default=None,
+                            help='Serve the fetch metrics in the Prometheus text format on this port.')
+        parser.add_argument('--metrics-address', default=settings.NEWSFEED_METRICS_ADDRESS,
+                            help='Address the metrics port listens on, local only by default.')
+
+    def handle(self, *args, **options):
+        if options['metrics_port'] and metrics.enabled():
+            metrics.serve(options['metrics_port'], options['metrics_address'])
+        while True:
+            try:
+                polled = refresh_due_feeds(limit=options['batch_size'])
+                prune_events()
+            except Exception:
+                if options['once']:
+                    raise
+                # e.g. the database went away: try again after the usual wait, the feeds
+                # this scan leased are claimed again when their lease runs out
+                logger.exception('Refreshing feeds failed')
+                close_old_connections()
+                polled = 0
+            if options['verbosity'] > 1 or (polled and options['verbosity'] > 0):
+                self.stdout.write('Polled %d feed(s)' % polled)
+            if options['once']:
+                break
+            if polled < options['batch_size']:
+                # nothing left to catch up on, wait for the next feeds to become due
+                time.sleep(options['sleep'])
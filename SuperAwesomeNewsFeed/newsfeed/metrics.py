@@ -0,0 +1,300 @@
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .normalization import display_url
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Metric:
+    """
+    A metric of the Prometheus text format, with one value per combination of label
+    values. Kept in this process's memory: with several worker processes each one
+    answers with its own numbers.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.kind)]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.extend(self._samples(key, value))
+        return lines
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def _samples(self, key, value):
+        return ['%s%s %s' % (self.name, self._labels(key), _number(value))]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def get(self, **labels):
+        """
+        Returns the number of observations and their sum.
+        """
+        counts, total = self.values.get(self._key(labels)) or ((), 0)
+        return sum(counts), total
+
+    def _samples(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            bound = '+Inf' if bound == float('inf') else _number(bound)
+            lines.append('%s_bucket%s %d' % (self.name, self._labels(key, [('le', bound)]), cumulative))
+        lines.append('%s_sum%s %s' % (self.name, self._labels(key), _number(total)))
+        lines.append('%s_count%s %d' % (self.name, self._labels(key), cumulative))
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = []
+
+REQUESTS = Counter('newsfeed_http_requests_total', 'HTTP requests by view, method and status.',
+                   ['view', 'method', 'status'])
+REQUEST_SECONDS = Histogram('newsfeed_http_request_duration_seconds', 'Time spent handling a request.', ['view'])
+REQUEST_QUERIES = Histogram('newsfeed_http_request_queries', 'SQL queries run while handling a request.', ['view'],
+                            buckets=QUERY_BUCKETS)
+REQUEST_QUERY_SECONDS = Histogram('newsfeed_http_request_query_duration_seconds',
+                                  'Time spent in SQL queries while handling a request.', ['view'])
+
+FETCHES = Counter('newsfeed_feed_fetches_total', 'Feed downloads by HTTP status ("error" when none came back).',
+                  ['status'])
+FETCH_SECONDS = Histogram('newsfeed_feed_fetch_duration_seconds', 'Time spent downloading a feed.')
+FETCH_BYTES = Counter('newsfeed_feed_fetch_bytes_total', 'Bytes of feed bodies downloaded.')
+PARSE_SECONDS = Histogram('newsfeed_feed_parse_duration_seconds', 'Time spent parsing a downloaded feed.')
+STORE_SECONDS = Histogram('newsfeed_feed_store_duration_seconds',
+                          'Time spent in the SQL queries storing a downloaded feed.')
+ITEMS_INSERTED = Counter('newsfeed_feed_items_inserted_total', 'News items stored from feeds.')
+
+
+def enabled():
+    return settings.NEWSFEED_METRICS
+
+
+def render():
+    """
+    Returns all metrics in the Prometheus text format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def log_event(event, **fields):
+    """
+    Writes fields as a line of JSON to the newsfeed.metrics logger, at INFO level.
+    """
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(dict(fields, event=event), sort_keys=True, default=str))
+
+
+# the QueryStats the current request or feed adds its SQL queries to
+_query_stats = ContextVar('newsfeed_query_stats', default=None)
+
+
+class QueryStats:
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+@contextmanager
+def track_queries():
+    """
+    Counts and times the SQL queries run within the block, including those run
+    by sync_to_async threads, into the QueryStats it yields.
+    """
+    stats = QueryStats()
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+
+def _time_query(execute, sql, params, many, context):
+    stats = _query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - start
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """
+    connection_created receiver that puts the query timer on every database
+    connection (see NewsfeedConfig.ready).
+    """
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+class MetricsMiddleware:
+    """
+    Records the count and duration of each request, and the number of SQL queries
+    it ran and the time they took, by view name. Goes away entirely when
+    NEWSFEED_METRICS is off.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with track_queries() as stats:
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, stats)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with track_queries() as stats:
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, stats)
+        return response
+
+    @staticmethod
+    def record(request, response, seconds, stats):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        REQUEST_SECONDS.observe(seconds, view=view)
+        REQUEST_QUERIES.observe(stats.count, view=view)
+        REQUEST_QUERY_SECONDS.observe(stats.seconds, view=view)
+        log_event('request', view=view, method=request.method, status=response.status_code, seconds=seconds,
+                  queries=stats.count, query_seconds=stats.seconds)
+
+
+def track_feed(handle, feed, response, parsed):
+    """
+    Returns handle(feed, response, parsed), the PollResult of storing a downloaded
+    and parsed feed, and records the download (status, bytes, time), the time the
+    parse took, the time of the queries storing it and the number of items inserted.
+    """
+    if not enabled():
+        return handle(feed, response, parsed)
+    with track_queries() as stats:
+        result = handle(feed, response, parsed)
+    parse_seconds = parsed.seconds if parsed is not None else None
+
+    status = str(response.status) if response.status is not None else 'error'
+    FETCHES.inc(status=status)
+    FETCH_SECONDS.observe(response.elapsed or 0)
+    FETCH_BYTES.inc(len(response.body))
+    if parse_seconds is not None:
+        PARSE_SECONDS.observe(parse_seconds)
+    STORE_SECONDS.observe(stats.seconds)
+    ITEMS_INSERTED.inc(result.inserted)
+    log_event('fetch', url=display_url(response.url), status=status, bytes=len(response.body), fetch_seconds=response.elapsed,
+              parse_seconds=parse_seconds, store_seconds=stats.seconds, queries=stats.count,
+              inserted=result.inserted)
+    return result
+
+
+def serve(port, address='127.0.0.1'):
+    """
+    Serves the metrics on their own port from a background thread, for processes
+    without a web server such as the refresh_feeds command. Only local clients
+    reach them unless another address is given. Returns the server.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
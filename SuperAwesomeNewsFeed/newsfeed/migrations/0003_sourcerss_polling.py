@@ -0,0 +1,28 @@
+# Generated by Django 2.0.4 on 2026-10-18 14:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsfeed', '0002_auto_20180419_1330'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sourcerss',
+            name='last_polled_at',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='sourcerss',
+            name='next_poll_at',
+            field=models.DateTimeField(db_index=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='sourcerss',
+            name='poll_interval',
+            field=models.PositiveIntegerField(default=900),
+        ),
+    ]
@@ -0,0 +1,74 @@
+import hashlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.db import migrations, models
+
+
+def normalize_url(url):
+    # frozen copy of normalization.normalize_url as of this migration
+    url = (url or '').strip()
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.netloc:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port in (None, {'http': 80, 'https': 443}.get(scheme)) else '%s:%d' % (host, port)
+    if parts.username:
+        netloc = '%s@%s' % (parts.username, netloc)
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not key.lower().startswith(('utm_', 'fbclid', 'gclid')))
+    return urlunsplit((scheme, netloc, parts.path or '/', urlencode(query), ''))
+
+
+def backfill_dedup_keys(apps, schema_editor):
+    """
+    Stored items have no guid, so they are keyed by their link (or title).
+    Items of a source that already share a key keep their own row by also
+    hashing their pk.
+    """
+    NewsItem = apps.get_model('newsfeed', 'NewsItem')
+    seen = set()
+    for pk, source_id, link, title in NewsItem.objects.order_by('pk').values_list('pk', 'source_id', 'link', 'title'):
+        if link and link.strip():
+            value = 'link:' + normalize_url(link)
+        else:
+            value = 'title:' + (title or '').strip()
+        if (source_id, value) in seen:
+            value = '%s#%d' % (value, pk)
+        seen.add((source_id, value))
+        key = hashlib.sha1(value.encode('utf-8')).hexdigest()
+        NewsItem.objects.filter(pk=pk).update(dedup_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsfeed', '0003_sourcerss_polling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsitem',
+            name='dedup_key',
+            field=models.CharField(max_length=40, null=True),
+        ),
+        migrations.RunPython(backfill_dedup_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='newsitem',
+            name='dedup_key',
+            field=models.CharField(max_length=40),
+        ),
+        migrations.AlterField(
+            model_name='newsitem',
+            name='title',
+            field=models.CharField(max_length=250),
+        ),
+        migrations.AlterUniqueTogether(
+            name='newsitem',
+            unique_together={('source', 'dedup_key')},
+        ),
+    ]
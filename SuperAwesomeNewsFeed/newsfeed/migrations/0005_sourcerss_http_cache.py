@@ -0,0 +1,61 @@
+from django.db import migrations, models
+
+
+def split_validators(apps, schema_editor):
+    """
+    Sources used to remember a single validator as a (tag, value) pair.
+    """
+    SourceRSS = apps.get_model('newsfeed', 'SourceRSS')
+    SourceRSS.objects.filter(last_modified_tag='ETag').update(etag=models.F('last_modified_value'))
+    SourceRSS.objects.filter(last_modified_tag='Last-Modified').update(last_modified=models.F('last_modified_value'))
+
+
+def join_validators(apps, schema_editor):
+    SourceRSS = apps.get_model('newsfeed', 'SourceRSS')
+    SourceRSS.objects.filter(last_modified__isnull=False).update(
+        last_modified_tag='Last-Modified', last_modified_value=models.F('last_modified'))
+    SourceRSS.objects.filter(etag__isnull=False).update(last_modified_tag='ETag', last_modified_value=models.F('etag'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsfeed', '0004_newsitem_dedup_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sourcerss',
+            name='etag',
+            field=models.TextField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='sourcerss',
+            name='last_modified',
+            field=models.TextField(default=None, null=True),
+        ),
+        migrations.RunPython(split_validators, join_validators),
+        migrations.RemoveField(
+            model_name='sourcerss',
+            name='last_modified_tag',
+        ),
+        migrations.RemoveField(
+            model_name='sourcerss',
+            name='last_modified_value',
+        ),
+        migrations.AddField(
+            model_name='sourcerss',
+            name='last_body_size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sourcerss',
+            name='not_modified_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sourcerss',
+            name='bytes_saved',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.0.13 on 2026-10-18 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsfeed', '0005_sourcerss_http_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sourcerss',
+            name='avg_fetch_latency',
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='sourcerss',
+            name='consecutive_failures',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sourcerss',
+            name='parked',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='sourcerss',
+            name='publish_rate',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,134 @@
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# state that moves from every SourceRSS to its shared Feed
+FEED_STATE = ['etag', 'last_modified', 'last_body_size', 'not_modified_count', 'bytes_saved', 'poll_interval',
+              'last_polled_at', 'next_poll_at', 'publish_rate', 'consecutive_failures', 'avg_fetch_latency', 'parked']
+
+
+def normalize_url(url):
+    # frozen copy of normalization.normalize_url as of this migration
+    url = (url or '').strip()
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.netloc:
+        return url
+    scheme = parts.scheme.lower()
+    userinfo, _, _ = parts.netloc.rpartition('@')
+    host = (parts.hostname or '').lower()
+    if ':' in host:
+        host = '[%s]' % host
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port in (None, {'http': 80, 'https': 443}.get(scheme)) else '%s:%d' % (host, port)
+    if userinfo:
+        netloc = '%s@%s' % (userinfo, netloc)
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not key.lower().startswith(('utm_', 'fbclid', 'gclid')))
+    return urlunsplit((scheme, netloc, parts.path or '/', urlencode(query), ''))
+
+
+def fold_sources_into_feeds(apps, schema_editor):
+    """
+    Gives every distinct normalized source url one Feed, taking over the fetch state
+    of the first source with that url, and moves the items onto the feeds. Items that
+    several sources of the same feed had stored are kept once, with their comments
+    and favorite flag merged into the oldest copy.
+    """
+    Feed = apps.get_model('newsfeed', 'Feed')
+    SourceRSS = apps.get_model('newsfeed', 'SourceRSS')
+    NewsItem = apps.get_model('newsfeed', 'NewsItem')
+    Comments = apps.get_model('newsfeed', 'Comments')
+
+    for source in SourceRSS.objects.order_by('pk'):
+        feed, created = Feed.objects.get_or_create(
+            url=normalize_url(source.source_url),
+            defaults={name: getattr(source, name) for name in FEED_STATE},
+        )
+        source.feed = feed
+        source.save(update_fields=['feed'])
+
+    kept = {}
+    for item in NewsItem.objects.select_related('source').order_by('pk'):
+        key = (item.source.feed_id, item.dedup_key)
+        if key in kept:
+            original = kept[key]
+            Comments.objects.filter(news_item=item).update(news_item=original)
+            if item.favorite and not original.favorite:
+                original.favorite = True
+                original.save(update_fields=['favorite'])
+            item.delete()
+        else:
+            item.feed_id = item.source.feed_id
+            item.save(update_fields=['feed'])
+            kept[key] = item
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsfeed', '0006_sourcerss_adaptive_polling'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Feed',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(unique=True)),
+                ('title', models.CharField(blank=True, default='', max_length=200)),
+                ('etag', models.TextField(default=None, null=True)),
+                ('last_modified', models.TextField(default=None, null=True)),
+                ('last_body_size', models.PositiveIntegerField(default=0)),
+                ('not_modified_count', models.PositiveIntegerField(default=0)),
+                ('bytes_saved', models.BigIntegerField(default=0)),
+                ('poll_interval', models.PositiveIntegerField(default=900)),
+                ('last_polled_at', models.DateTimeField(default=None, null=True)),
+                ('next_poll_at', models.DateTimeField(db_index=True, default=None, null=True)),
+                ('publish_rate', models.FloatField(default=0)),
+                ('consecutive_failures', models.PositiveIntegerField(default=0)),
+                ('avg_fetch_latency', models.FloatField(default=None, null=True)),
+                ('parked', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='sourcerss',
+            name='feed',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE,
+                                    related_name='subscriptions', to='newsfeed.Feed'),
+        ),
+        migrations.AddField(
+            model_name='newsitem',
+            name='feed',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='newsfeed.Feed'),
+        ),
+        migrations.RunPython(fold_sources_into_feeds, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='newsitem',
+            unique_together=set(),
+        ),
+        migrations.RemoveField(
+            model_name='newsitem',
+            name='source',
+        ),
+        migrations.AlterField(
+            model_name='newsitem',
+            name='feed',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='newsfeed.Feed'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='newsitem',
+            unique_together={('feed', 'dedup_key')},
+        ),
+        migrations.AlterField(
+            model_name='sourcerss',
+            name='feed',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subscriptions',
+                                    to='newsfeed.Feed'),
+        ),
+    ] + [
+        migrations.RemoveField(model_name='sourcerss', name=name) for name in FEED_STATE
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.0.13 on 2026-10-18 14:57
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsfeed', '0007_shared_feeds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsitem',
+            name='published_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='newsitem',
+            index=models.Index(fields=['feed', '-published_at', '-id'], name='newsitem_feed_published_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.0.13 on 2026-10-18 15:01
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsfeed', '0008_newsitem_published_at'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='newsitem',
+            options={'ordering': ['-published_at', '-id']},
+        ),
+        migrations.AddField(
+            model_name='newsitem',
+            name='fetched_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='newsitem',
+            index=models.Index(fields=['feed', 'fetched_at'], name='newsitem_feed_fetched_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 2.0.13 on 2026-10-18 15:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_favorites(apps, schema_editor):
+    """
+    The favorite flag was shared by everyone, so every subscriber of the item's feed
+    gets it as their own favorite.
+    """
+    NewsItem = apps.get_model('newsfeed', 'NewsItem')
+    SourceRSS = apps.get_model('newsfeed', 'SourceRSS')
+    ItemState = apps.get_model('newsfeed', 'ItemState')
+    for item in NewsItem.objects.filter(favorite=True):
+        users = set(SourceRSS.objects.filter(feed_id=item.feed_id).values_list('user_id', flat=True))
+        ItemState.objects.bulk_create(ItemState(user_id=user_id, item=item, state='favorite') for user_id in users)
+
+
+def restore_favorites(apps, schema_editor):
+    NewsItem = apps.get_model('newsfeed', 'NewsItem')
+    ItemState = apps.get_model('newsfeed', 'ItemState')
+    favorites = ItemState.objects.filter(state='favorite').values('item')
+    NewsItem.objects.filter(pk__in=favorites).update(favorite=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('newsfeed', '0009_newsitem_fetched_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('favorite', 'Favorite'), ('read', 'Read'), ('hidden', 'Hidden')], max_length=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='itemstate',
+            name='item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='states', to='newsfeed.NewsItem'),
+        ),
+        migrations.AddField(
+            model_name='itemstate',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='itemstate',
+            unique_together={('user', 'state', 'item')},
+        ),
+        migrations.RunPython(copy_favorites, restore_favorites),
+        migrations.RemoveField(
+            model_name='newsitem',
+            name='favorite',
+        ),
+    ]
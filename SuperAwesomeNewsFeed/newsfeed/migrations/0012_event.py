@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:17
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsfeed', '0011_commentlike'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Event',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('item', 'New item'), ('comment', 'Comment'), ('like', 'Like')], max_length=10)),
+                ('payload', models.TextField()),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('feed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='newsfeed.feed')),
+            ],
+        ),
+    ]
@@ -0,0 +1,73 @@
+from django.db import migrations
+
+# SQLite: an FTS5 index over the items table, kept in step with it by triggers
+SQLITE_CREATE = [
+    """
+    CREATE VIRTUAL TABLE newsfeed_newsitem_fts USING fts5(
+        title, summary, content='newsfeed_newsitem', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER newsfeed_newsitem_fts_insert AFTER INSERT ON newsfeed_newsitem BEGIN
+        INSERT INTO newsfeed_newsitem_fts(rowid, title, summary) VALUES (new.id, new.title, new.summary);
+    END
+    """,
+    """
+    CREATE TRIGGER newsfeed_newsitem_fts_delete AFTER DELETE ON newsfeed_newsitem BEGIN
+        INSERT INTO newsfeed_newsitem_fts(newsfeed_newsitem_fts, rowid, title, summary)
+        VALUES ('delete', old.id, old.title, old.summary);
+    END
+    """,
+    """
+    CREATE TRIGGER newsfeed_newsitem_fts_update AFTER UPDATE OF title, summary ON newsfeed_newsitem BEGIN
+        INSERT INTO newsfeed_newsitem_fts(newsfeed_newsitem_fts, rowid, title, summary)
+        VALUES ('delete', old.id, old.title, old.summary);
+        INSERT INTO newsfeed_newsitem_fts(rowid, title, summary) VALUES (new.id, new.title, new.summary);
+    END
+    """,
+    # index the items stored so far
+    "INSERT INTO newsfeed_newsitem_fts(newsfeed_newsitem_fts) VALUES ('rebuild')",
+]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS newsfeed_newsitem_fts_insert',
+    'DROP TRIGGER IF EXISTS newsfeed_newsitem_fts_delete',
+    'DROP TRIGGER IF EXISTS newsfeed_newsitem_fts_update',
+    'DROP TABLE IF EXISTS newsfeed_newsitem_fts',
+]
+
+# PostgreSQL: a generated tsvector column (titles weigh more) with a GIN index
+POSTGRESQL_CREATE = [
+    """
+    ALTER TABLE newsfeed_newsitem ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(summary, '')), 'B')
+    ) STORED
+    """,
+    'CREATE INDEX newsfeed_newsitem_search_idx ON newsfeed_newsitem USING GIN (search_vector)',
+]
+POSTGRESQL_DROP = [
+    'DROP INDEX IF EXISTS newsfeed_newsitem_search_idx',
+    'ALTER TABLE newsfeed_newsitem DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        # other databases have no index and newsfeed.search falls back to a scan
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsfeed', '0012_event'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_CREATE, 'postgresql': POSTGRESQL_CREATE}),
+            run({'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP}),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsfeed', '0013_newsitem_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshJob',
+            fields=[
+                ('feed', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='refresh_job', serialize=False, to='newsfeed.feed')),
+                ('leased_by', models.CharField(default=None, max_length=64, null=True)),
+                ('leased_until', models.DateTimeField(default=None, null=True)),
+            ],
+        ),
+    ]
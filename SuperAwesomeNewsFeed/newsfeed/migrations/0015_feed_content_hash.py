@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsfeed', '0014_refreshjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='content_hash',
+            field=models.CharField(default=None, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='unchanged_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
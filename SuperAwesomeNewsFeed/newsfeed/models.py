@@ -1,27 +1,205 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .normalization import display_url, entry_key, normalize_url
+
+
+class FeedManager(models.Manager):
+
+    def for_url(self, url):
+        """
+        Returns the feed of url, creating it the first time anybody subscribes to it.
+        """
+        return self.get_or_create(url=normalize_url(url))[0]
+
+
+class Feed(models.Model):
+    """
+    A single RSS/Atom feed, fetched and stored once however many users subscribe to it.
+    """
+    url = models.URLField(unique=True)  # normalized, see normalization.normalize_url
+    title = models.CharField(max_length=200, blank=True, default='')
+    # HTTP validators of the last full response, sent back to get a 304 when nothing changed
+    etag = models.TextField(null=True, default=None)
+    last_modified = models.TextField(null=True, default=None)
+    last_body_size = models.PositiveIntegerField(default=0)  # bytes
+    # what the 304 answers spared us
+    not_modified_count = models.PositiveIntegerField(default=0)
+    bytes_saved = models.BigIntegerField(default=0)
+    # SHA-256 of the last body stored, a 200 answer with the same body isn't parsed again
+    content_hash = models.CharField(max_length=64, null=True, default=None)
+    unchanged_count = models.PositiveIntegerField(default=0)
+    # scheduling state, see scheduler.schedule_next_poll
+    poll_interval = models.PositiveIntegerField(default=15 * 60)  # seconds
+    last_polled_at = models.DateTimeField(null=True, default=None)
+    next_poll_at = models.DateTimeField(null=True, default=None, db_index=True)
+    publish_rate = models.FloatField(default=0)  # new items per hour
+    consecutive_failures = models.PositiveIntegerField(default=0)
+    avg_fetch_latency = models.FloatField(null=True, default=None)  # seconds
+    parked = models.BooleanField(default=False)
+
+    objects = FeedManager()
+
+    def __str__(self):
+        return self.title or display_url(self.url)
 
 
 class SourceRSS(models.Model):
+    """
+    A user's subscription to a feed, under the name they gave it.
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     source_name = models.CharField(max_length=100)
     source_url = models.URLField()
-    last_modified_tag = models.CharField(max_length=50, null=True, default=None)
-    last_modified_value = models.TextField(null=True, default=None)
+    feed = models.ForeignKey(Feed, on_delete=models.CASCADE, related_name='subscriptions')
 
     def __str__(self):
-        return self.source_name + ': ' + self.source_url
+        return self.source_name + ': ' + display_url(self.source_url)
+
+    def save(self, *args, **kwargs):
+        url = normalize_url(self.source_url)
+        if self.feed_id is None or self.feed.url != url:
+            self.feed = Feed.objects.for_url(url)
+        super().save(*args, **kwargs)
+
+
+class NewsItemQuerySet(models.QuerySet):
+
+    def for_user(self, user):
+        """
+        Returns the items of the feeds user subscribes to, newest first. Each item comes
+        with its feed, the name user gave the source as source_name and its number of
+        comments as comment_count, so a whole page of them is fetched with one query.
+        """
+        subscriptions = SourceRSS.objects.filter(user=user)
+        comments = Comments.objects.filter(news_item=OuterRef('pk')).order_by().values('news_item')
+        states = ItemState.objects.filter(user=user, item=OuterRef('pk'))
+        return self.filter(feed__in=subscriptions.values('feed')).select_related('feed').annotate(
+            source_name=Subquery(subscriptions.filter(feed=OuterRef('feed')).values('source_name')[:1]),
+            comment_count=Coalesce(Subquery(comments.annotate(count=Count('pk')).values('count'),
+                                            output_field=models.IntegerField()), 0),
+            is_favorite=Exists(states.filter(state=ItemState.FAVORITE)),
+            is_read=Exists(states.filter(state=ItemState.READ)),
+            is_hidden=Exists(states.filter(state=ItemState.HIDDEN)),
+        )
+
+    def listing(self, user, name):
+        """
+        Narrows a for_user() queryset down to one of the newsfeed listings:
+        'favorites', 'unread', 'hidden', or anything else for all items that
+        aren't hidden.
+        """
+        if name == 'favorites':
+            return self.in_state(user, ItemState.FAVORITE)
+        if name == 'hidden':
+            return self.in_state(user, ItemState.HIDDEN)
+        if name == 'unread':
+            return self.filter(is_read=False, is_hidden=False)
+        return self.filter(is_hidden=False)
+
+    def in_state(self, user, state):
+        """
+        Returns the items user has marked with state (one of ItemState.STATES).
+        """
+        return self.filter(states__user=user, states__state=state)
+
+    def since(self, when):
+        """
+        Returns the items fetched after when, i.e. the ones that are new to a reader
+        who last looked at that time.
+        """
+        return self.filter(fetched_at__gt=when)
 
 
 class NewsItem(models.Model):
-    source = models.ForeignKey(SourceRSS, on_delete=models.CASCADE)
-    title = models.CharField(max_length=250, unique=True)
+    feed = models.ForeignKey(Feed, on_delete=models.CASCADE)
+    title = models.CharField(max_length=250)
     summary = models.TextField(max_length=500)
     link = models.URLField()
-    favorite = models.BooleanField(default=False)
+    published_at = models.DateTimeField(default=timezone.now)
+    fetched_at = models.DateTimeField(default=timezone.now)
+    # identifies the entry within its feed, see normalization.entry_key
+    dedup_key = models.CharField(max_length=40)
+
+    objects = NewsItemQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-published_at', '-id']
+        unique_together = ('feed', 'dedup_key')
+        indexes = [
+            # a user's feed page: the newest items of the feeds they subscribe to
+            models.Index(fields=['feed', '-published_at', '-id'], name='newsitem_feed_published_idx'),
+            # what arrived in those feeds since a given time
+            models.Index(fields=['feed', 'fetched_at'], name='newsitem_feed_fetched_idx'),
+        ]
 
     def __str__(self):
-        return self.source.source_name + ': ' + self.title
+        return str(self.feed) + ': ' + self.title
+
+    def save(self, *args, **kwargs):
+        if not self.dedup_key:
+            self.dedup_key = entry_key(link=self.link, title=self.title)
+        super().save(*args, **kwargs)
+
+
+class ItemStateManager(models.Manager):
+
+    def toggle(self, user, item, state):
+        """
+        Marks item with state for user, or unmarks it if it already was. Returns
+        whether the item is marked afterwards.
+
+        Each step is a single statement on the (user, state, item) unique index, so two
+        toggles racing each other can't leave the item half updated.
+        """
+        deleted, _ = self.filter(user=user, item=item, state=state).delete()
+        if deleted:
+            return False
+        self.mark(user, item, state)
+        return True
+
+    def mark(self, user, item, state):
+        """
+        Marks item with state for user, if it isn't already.
+        """
+        try:
+            with transaction.atomic():
+                self.create(user=user, item=item, state=state)
+        except IntegrityError:
+            # already marked, e.g. by a concurrent request
+            pass
+
+
+class ItemState(models.Model):
+    """
+    A user's mark on a news item: favorite, read or hidden. An item carries one row
+    per user and state that is set, and none for states that aren't.
+    """
+    FAVORITE = 'favorite'
+    READ = 'read'
+    HIDDEN = 'hidden'
+    STATES = (
+        (FAVORITE, 'Favorite'),
+        (READ, 'Read'),
+        (HIDDEN, 'Hidden'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    item = models.ForeignKey(NewsItem, on_delete=models.CASCADE, related_name='states')
+    state = models.CharField(max_length=10, choices=STATES)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ItemStateManager()
+
+    class Meta:
+        # also the index behind the favorites, unread and hidden listings of a user
+        unique_together = ('user', 'state', 'item')
+
+    def __str__(self):
+        return '%s: %s %s' % (self.user.username, self.state, self.item.title)
 
 
 class Comments(models.Model):
@@ -33,3 +211,61 @@ class Comments(models.Model):
 
     def __str__(self):
         return self.user.username + ': ' + self.comment
+
+
+class CommentLike(models.Model):
+    """
+    A user's like of a comment, so nobody can like the same comment twice.
+    Comments.likes keeps the running total.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    comment = models.ForeignKey(Comments, on_delete=models.CASCADE, related_name='comment_likes')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'comment')
+
+    def __str__(self):
+        return self.user.username + ' likes ' + str(self.comment)
+
+
+class Event(models.Model):
+    """
+    Something that changed in a feed (a new item, a comment or like on one of its
+    items), kept for a while so the event stream can push it to the feed's
+    subscribers, even from another process, and replay it after a reconnect.
+    """
+    ITEM = 'item'
+    COMMENT = 'comment'
+    LIKE = 'like'
+    KINDS = (
+        (ITEM, 'New item'),
+        (COMMENT, 'Comment'),
+        (LIKE, 'Like'),
+    )
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+    feed = models.ForeignKey(Feed, on_delete=models.CASCADE)
+    # JSON sent to the clients as the event's data
+    payload = models.TextField()
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return '%s %s: %s' % (self.kind, self.feed, self.payload)
+
+
+class RefreshJob(models.Model):
+    """
+    The lease on refreshing a feed. A refresher claims the due feeds it's about to
+    poll by writing its claim token and an expiry time here, so other refreshers,
+    in this or any other process, leave them alone until it releases them or the
+    lease runs out (see scheduler.claim_due_feeds).
+    """
+    feed = models.OneToOneField(Feed, on_delete=models.CASCADE, primary_key=True, related_name='refresh_job')
+    leased_by = models.CharField(max_length=64, null=True, default=None)
+    leased_until = models.DateTimeField(null=True, default=None)
+
+    def __str__(self):
+        if self.leased_by is None:
+            return '%s: free' % self.feed
+        return '%s: leased by %s until %s' % (self.feed, self.leased_by, self.leased_until)
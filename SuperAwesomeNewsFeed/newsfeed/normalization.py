@@ -0,0 +1,65 @@
+import hashlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# query parameters that only track where a click came from
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid')
+
+
+def normalize_url(url):
+    """
+    Returns url in a canonical form, so that the different ways of writing the
+    same address compare equal: lowercase scheme and host, no default port, no
+    fragment, no tracking parameters and sorted query parameters. The user name
+    and password are kept as they are, the feed is fetched with them.
+    """
+    url = (url or '').strip()
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.netloc:
+        return url
+
+    scheme = parts.scheme.lower()
+    userinfo, _, _ = parts.netloc.rpartition('@')
+    host = (parts.hostname or '').lower()
+    if ':' in host:
+        # an IPv6 address
+        host = '[%s]' % host
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port in (None, DEFAULT_PORTS.get(scheme)) else '%s:%d' % (host, port)
+    if userinfo:
+        netloc = '%s@%s' % (userinfo, netloc)
+
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not key.lower().startswith(TRACKING_PARAMS))
+    return urlunsplit((scheme, netloc, parts.path or '/', urlencode(query), ''))
+
+
+def display_url(url):
+    """
+    Returns url with its password masked, for logs, the admin and anything else
+    written out. Only the fetcher is given the real one.
+    """
+    parts = urlsplit(url or '')
+    userinfo, at, host = parts.netloc.rpartition('@')
+    if not at or ':' not in userinfo:
+        return url
+    return urlunsplit(parts._replace(netloc='%s:***@%s' % (userinfo.partition(':')[0], host)))
+
+
+def entry_key(guid=None, link=None, title=None):
+    """
+    Returns the compact key identifying a feed entry within its source: a hash of
+    the entry's guid if it has one, otherwise of its normalized link (or, for
+    entries without either, of its title).
+    """
+    if guid and guid.strip():
+        value = 'guid:' + guid.strip()
+    elif link and link.strip():
+        value = 'link:' + normalize_url(link)
+    else:
+        value = 'title:' + (title or '').strip()
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
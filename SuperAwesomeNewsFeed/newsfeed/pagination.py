@@ -0,0 +1,126 @@
+import base64
+from collections import namedtuple
+from datetime import datetime, time
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+# items is the list for this page, the cursors are None when there's nothing further that way
+Page = namedtuple('Page', ['items', 'next_cursor', 'prev_cursor'])
+
+AFTER = 'a'
+BEFORE = 'b'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(item, direction):
+    """
+    Returns an opaque cursor pointing at the items after (older than) or before
+    (newer than) item, depending on direction. item is a NewsItem or a dict with
+    its id and published_at.
+    """
+    if isinstance(item, dict):
+        # a row of a values() queryset
+        published_at, pk = item['published_at'], item['id']
+    else:
+        published_at, pk = item.published_at, item.pk
+    value = '%s|%s|%d' % (direction, published_at.isoformat(), pk)
+    return base64.urlsafe_b64encode(value.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (direction, published_at, pk) a cursor from encode_cursor points at.
+    """
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        direction, published_at, pk = value.split('|')
+        published_at = parse_datetime(published_at)
+        pk = int(pk)
+    except ValueError:
+        raise InvalidCursor(cursor)
+    if direction not in (AFTER, BEFORE) or published_at is None:
+        raise InvalidCursor(cursor)
+    return direction, published_at, pk
+
+
+def _page_query(queryset, cursor, page_size):
+    # the rows of the page in the order to fetch them, plus one to tell whether
+    # there is anything past it
+    if cursor is None:
+        return None, queryset.order_by('-published_at', '-id')[:page_size + 1]
+    direction, published_at, pk = decode_cursor(cursor)
+    if direction == AFTER:
+        older = Q(published_at__lt=published_at) | Q(published_at=published_at, id__lt=pk)
+        return direction, queryset.filter(older).order_by('-published_at', '-id')[:page_size + 1]
+    # walk up from the cursor, the page is flipped back to newest first in _page()
+    newer = Q(published_at__gt=published_at) | Q(published_at=published_at, id__gt=pk)
+    return direction, queryset.filter(newer).order_by('published_at', 'id')[:page_size + 1]
+
+
+def _page(rows, direction, page_size):
+    if direction == BEFORE:
+        rows.reverse()
+
+    # the extra row only tells whether there is anything past this page
+    more = len(rows) > page_size
+    if direction == BEFORE:
+        items = rows[-page_size:]
+        has_next, has_prev = True, more
+    else:
+        items = rows[:page_size]
+        has_next, has_prev = more, direction == AFTER
+
+    next_cursor = encode_cursor(items[-1], AFTER) if items and has_next else None
+    prev_cursor = encode_cursor(items[0], BEFORE) if items and has_prev else None
+    return Page(items, next_cursor, prev_cursor)
+
+
+def paginate(queryset, cursor=None, page_size=None):
+    """
+    Returns a Page of a queryset of news items ordered newest first, by
+    (published_at, id).
+
+    Pages are found by comparing against the (published_at, id) of the item next to
+    them rather than with OFFSET, so the database walks the published_at index
+    straight to the page and any page costs the same as the first one.
+    """
+    page_size = page_size or settings.NEWSFEED_PAGE_SIZE
+    direction, rows = _page_query(queryset, cursor, page_size)
+    return _page(list(rows), direction, page_size)
+
+
+async def apaginate(queryset, cursor=None, page_size=None):
+    """
+    Async version of paginate().
+    """
+    page_size = page_size or settings.NEWSFEED_PAGE_SIZE
+    direction, rows = _page_query(queryset, cursor, page_size)
+    return _page([row async for row in rows], direction, page_size)
+
+
+def parse_since(value):
+    """
+    Returns the aware datetime a since= query parameter asks for, given as an ISO
+    8601 datetime or date (times without an offset are in the current time zone),
+    or None if value is missing or unreadable.
+    """
+    if not value:
+        return None
+    try:
+        since = parse_datetime(value)
+        if since is None:
+            date = parse_date(value)
+            if date is None:
+                return None
+            since = datetime.combine(date, time())
+    except ValueError:
+        return None
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
@@ -0,0 +1,44 @@
+import time
+from collections import namedtuple
+from itertools import islice
+from xml.etree.ElementTree import ParseError
+
+import feedparser
+
+from .streaming import StreamingFeed
+
+# keys of a parsed entry that add_news_items looks at
+ENTRY_FIELDS = ('title', 'link', 'id', 'summary', 'published_parsed', 'updated_parsed', 'created_parsed')
+
+# entries are plain dicts of ENTRY_FIELDS, seconds is the time the parse took, stream_error
+# why StreamingFeed gave up before feedparser took over and error why the parse failed
+ParsedFeed = namedtuple('ParsedFeed', ['title', 'entries', 'seconds', 'stream_error', 'error'],
+                        defaults=[None, None])
+
+
+def parse_feed(body, headers, stream, known_keys, max_entries, stop_after_known, complete):
+    """
+    Parses a feed document into a ParsedFeed holding at most max_entries entries.
+
+    With stream, the body is read with StreamingFeed, which stops at the first
+    stop_after_known entries in a row that are in known_keys, and feedparser only
+    reads documents it can't parse. Without it feedparser reads everything.
+
+    Runs in the parse processes of utils.parse_responses: everything comes in as
+    arguments and goes out as plain values, nothing here needs Django.
+    """
+    start = time.perf_counter()
+    stream_error = None
+    if stream:
+        document = StreamingFeed(body, known_keys, max_entries=max_entries, stop_after_known=stop_after_known,
+                                 complete=complete)
+        try:
+            entries = list(document.entries)
+            return ParsedFeed(document.feed.get('title'), entries, time.perf_counter() - start)
+        except ParseError as error:
+            stream_error = str(error)
+
+    document = feedparser.parse(body, response_headers=headers)
+    entries = [{name: entry[name] for name in ENTRY_FIELDS if entry.get(name) is not None}
+               for entry in islice(document.entries, max_entries)]
+    return ParsedFeed(document.feed.get('title'), entries, time.perf_counter() - start, stream_error)
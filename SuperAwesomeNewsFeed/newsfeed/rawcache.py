@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from django.conf import settings
+
+from .fetcher import FeedResponse
+from .normalization import display_url
+
+
+def content_hash(body):
+    """
+    Returns the SHA-256 hex digest of a response body, the name it's kept under
+    and what Feed.content_hash compares.
+    """
+    return hashlib.sha256(body).hexdigest()
+
+
+def _directory(directory):
+    return directory or settings.NEWSFEED_RAW_CACHE_DIR
+
+
+def _path(directory, kind, digest, suffix=''):
+    return os.path.join(directory, kind, digest[:2], digest + suffix)
+
+
+def _response_path(directory, url):
+    # kept and replayed under the url with its password masked, which is never written out
+    return _path(directory, 'responses', content_hash(display_url(url).encode('utf-8')), '.json')
+
+
+def _write(path, data):
+    # written next to its place and moved there, so a reader never sees half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def record(response, directory=None):
+    """
+    Keeps the body of a successful FeedResponse under its content hash, once
+    however many feeds or polls return it, and makes it the response replayed
+    for its URL along with its status and headers.
+    """
+    directory = _directory(directory)
+    digest = content_hash(response.body)
+    body_path = _path(directory, 'bodies', digest)
+    if not os.path.exists(body_path):
+        _write(body_path, response.body)
+    _write(_response_path(directory, response.url), json.dumps({
+        'url': display_url(response.url),
+        'status': response.status,
+        'headers': response.headers,
+        'body': digest,
+        'truncated': response.truncated,
+    }).encode('utf-8'))
+
+
+def recorded_urls(directory=None):
+    """
+    Yields the URL of every recorded response.
+    """
+    directory = os.path.join(_directory(directory), 'responses')
+    for path, _, names in sorted(os.walk(directory)):
+        for name in sorted(names):
+            with open(os.path.join(path, name), 'rb') as file:
+                yield json.load(file)['url']
+
+
+def replay(request, directory=None):
+    """
+    Returns the FeedResponse recorded for a FeedRequest's URL, as if it were
+    downloaded again: 304 when the request's validators match it, and an error
+    when nothing was recorded for the URL.
+    """
+    directory = _directory(directory)
+    path = _response_path(directory, request.url)
+    if not os.path.exists(path):
+        return FeedResponse(request.key, request.url, None, {}, b'',
+                            LookupError('No response recorded for %s' % display_url(request.url)), 0)
+    try:
+        with open(path, 'rb') as file:
+            recorded = json.load(file)
+        with open(_path(directory, 'bodies', recorded['body']), 'rb') as file:
+            body = file.read()
+    except (OSError, ValueError, KeyError) as error:
+        return FeedResponse(request.key, request.url, None, {}, b'', error, 0)
+
+    headers = recorded['headers']
+    request_headers = request.headers or {}
+    etag, last_modified = headers.get('etag'), headers.get('last-modified')
+    if (etag and request_headers.get('If-None-Match') == etag) or \
+            (last_modified and request_headers.get('If-Modified-Since') == last_modified):
+        return FeedResponse(request.key, request.url, 304, headers, b'', None, 0)
+    return FeedResponse(request.key, request.url, recorded['status'], headers, body, None, 0, recorded['truncated'])
+
+
+def replay_feeds(requests, directory=None):
+    """
+    Yields the replayed FeedResponse of each FeedRequest, in place of
+    fetcher.fetch_feeds.
+    """
+    for request in requests:
+        yield replay(request, directory)
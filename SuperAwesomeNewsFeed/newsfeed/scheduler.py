@@ -0,0 +1,156 @@
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .models import Feed, RefreshJob, SourceRSS
+from .utils import rss_parser
+
+logger = logging.getLogger(__name__)
+
+# weight of the newest observation in the moving averages of publish rate and fetch latency
+SMOOTHING = 0.3
+
+
+def due_feeds(now=None):
+    """
+    Returns the subscribed feeds whose next poll time has passed, most overdue first.
+    Feeds that have never been polled are always due.
+    """
+    now = now or timezone.now()
+    subscribed = SourceRSS.objects.filter(feed=OuterRef('pk'))
+    return Feed.objects.annotate(subscribed=Exists(subscribed)).filter(
+        Q(next_poll_at__isnull=True) | Q(next_poll_at__lte=now), subscribed=True,
+    ).order_by(F('next_poll_at').asc(nulls_first=True), 'pk')
+
+
+def schedule_next_poll(feed, now=None, result=None):
+    """
+    Records the PollResult of polling the feed and when it is due again.
+
+    Working feeds are polled about as often as they publish: when a poll brings
+    new items the interval becomes the expected time between two items, from a
+    moving average of the observed publish rate, and every poll that brings nothing
+    stretches it by NEWSFEED_POLL_BACKOFF. It stays between NEWSFEED_MIN_POLL_INTERVAL
+    and NEWSFEED_MAX_POLL_INTERVAL.
+
+    Failing feeds are retried after NEWSFEED_MIN_POLL_INTERVAL, doubled with every
+    failure in a row. After NEWSFEED_PARK_AFTER_FAILURES of them the feed is parked
+    and only tried every NEWSFEED_PARKED_POLL_INTERVAL until it works again.
+
+    A later next poll asked for by the server (result.not_before) is honoured up to
+    NEWSFEED_MAX_POLL_INTERVAL.
+    """
+    now = now or timezone.now()
+    min_interval = settings.NEWSFEED_MIN_POLL_INTERVAL
+    max_interval = settings.NEWSFEED_MAX_POLL_INTERVAL
+
+    if result is not None and result.elapsed is not None:
+        if feed.avg_fetch_latency is None:
+            feed.avg_fetch_latency = result.elapsed
+        else:
+            feed.avg_fetch_latency += SMOOTHING * (result.elapsed - feed.avg_fetch_latency)
+
+    if result is None or result.error is not None or (result.status or 0) >= 400:
+        feed.consecutive_failures += 1
+        if feed.consecutive_failures >= settings.NEWSFEED_PARK_AFTER_FAILURES:
+            feed.parked = True
+            delay = settings.NEWSFEED_PARKED_POLL_INTERVAL
+        else:
+            delay = min(min_interval * 2 ** (feed.consecutive_failures - 1), max_interval)
+    else:
+        feed.consecutive_failures = 0
+        feed.parked = False
+        if feed.last_polled_at is not None:
+            # the first poll picks up the feed's whole backlog, which says nothing about its rate
+            hours = max((now - feed.last_polled_at).total_seconds(), 1) / 3600
+            feed.publish_rate += SMOOTHING * (result.inserted / hours - feed.publish_rate)
+            if result.inserted:
+                interval = 3600 / feed.publish_rate
+            else:
+                interval = feed.poll_interval * settings.NEWSFEED_POLL_BACKOFF
+            feed.poll_interval = int(min(max(interval, min_interval), max_interval))
+        delay = feed.poll_interval
+
+    next_poll_at = now + timedelta(seconds=delay)
+    if result is not None and result.not_before is not None:
+        next_poll_at = max(next_poll_at, min(result.not_before, now + timedelta(seconds=max_interval)))
+
+    feed.last_polled_at = now
+    feed.next_poll_at = next_poll_at
+    feed.save(update_fields=['poll_interval', 'last_polled_at', 'next_poll_at', 'publish_rate',
+                               'consecutive_failures', 'avg_fetch_latency', 'parked'])
+
+
+def claim_due_feeds(limit=None, now=None, lease=None):
+    """
+    Leases at most limit of the due feeds that nobody else holds, for lease seconds
+    (NEWSFEED_REFRESH_LEASE by default), and returns the claim token and the feeds,
+    most overdue first. Any number of refreshers can claim at the same time, on any
+    number of machines, and never get the same feed; the feeds of one that crashed
+    are claimed again once its lease has run out.
+
+    On databases with SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL) the job rows
+    are locked and leased in one transaction, skipping those another refresher is
+    claiming. On SQLite a single UPDATE picks and leases them, and SQLite runs one
+    write at a time.
+    """
+    now = now or timezone.now()
+    lease = settings.NEWSFEED_REFRESH_LEASE if lease is None else lease
+    token = uuid.uuid4().hex
+    leased = {'leased_by': token, 'leased_until': now + timedelta(seconds=lease)}
+
+    # feeds get their job row the first time they are due
+    new = Feed.objects.filter(subscriptions__isnull=False, refresh_job__isnull=True).values_list('pk', flat=True)
+    RefreshJob.objects.bulk_create([RefreshJob(feed_id=pk) for pk in set(new)], ignore_conflicts=True)
+
+    jobs = RefreshJob.objects.filter(
+        Q(leased_until__isnull=True) | Q(leased_until__lte=now), feed__in=due_feeds(now).values('pk'),
+    ).order_by(F('feed__next_poll_at').asc(nulls_first=True), 'feed')
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            pks = [job.pk for job in jobs.select_for_update(skip_locked=True, of=('self',))[:limit]]
+            # a feed another refresher polled and released after this transaction's first
+            # statement began isn't due anymore when read again
+            pks = list(due_feeds(now).filter(pk__in=pks).values_list('pk', flat=True))
+            RefreshJob.objects.filter(pk__in=pks).update(**leased)
+    else:
+        RefreshJob.objects.filter(pk__in=jobs.values('pk')[:limit]).update(**leased)
+
+    feeds = Feed.objects.filter(refresh_job__leased_by=token)
+    return token, list(feeds.order_by(F('next_poll_at').asc(nulls_first=True), 'pk'))
+
+
+def release_feed(feed, token):
+    """
+    Gives up the lease on feed taken with token, if it's still held.
+    """
+    RefreshJob.objects.filter(pk=feed.pk, leased_by=token).update(leased_by=None, leased_until=None)
+
+
+def refresh_due_feeds(limit=None, now=None):
+    """
+    Claims the due feeds (at most limit of them), polls them and schedules their
+    next poll. Feeds that fail are rescheduled too, so they can't stall the others.
+    When polling the batch raises, the feeds without a result are rescheduled as
+    failed polls rather than left leased until the lease runs out.
+
+    Returns the number of feeds polled.
+    """
+    now = now or timezone.now()
+    token, feeds = claim_due_feeds(limit, now)
+    try:
+        results = rss_parser([feed.pk for feed in feeds])
+    except Exception:
+        logger.exception('Polling %d feed(s) failed', len(feeds))
+        results = {}
+    for feed in feeds:
+        # released together with the new schedule, so no other refresher finds it still due
+        with transaction.atomic():
+            schedule_next_poll(feed, now, results.get(feed.pk))
+            release_feed(feed, token)
+    return len(feeds)
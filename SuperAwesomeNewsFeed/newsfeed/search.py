@@ -0,0 +1,97 @@
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+
+from .models import NewsItem
+
+# keep in step with migration 0013_newsitem_search_index
+SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS newsfeed_newsitem_fts_insert AFTER INSERT ON newsfeed_newsitem BEGIN
+        INSERT INTO newsfeed_newsitem_fts(rowid, title, summary) VALUES (new.id, new.title, new.summary);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS newsfeed_newsitem_fts_delete AFTER DELETE ON newsfeed_newsitem BEGIN
+        INSERT INTO newsfeed_newsitem_fts(newsfeed_newsitem_fts, rowid, title, summary)
+        VALUES ('delete', old.id, old.title, old.summary);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS newsfeed_newsitem_fts_update AFTER UPDATE OF title, summary ON newsfeed_newsitem
+    BEGIN
+        INSERT INTO newsfeed_newsitem_fts(newsfeed_newsitem_fts, rowid, title, summary)
+        VALUES ('delete', old.id, old.title, old.summary);
+        INSERT INTO newsfeed_newsitem_fts(rowid, title, summary) VALUES (new.id, new.title, new.summary);
+    END
+    """,
+]
+
+SQLITE_SEARCH = """
+    SELECT item.id FROM newsfeed_newsitem_fts
+    JOIN newsfeed_newsitem item ON item.id = newsfeed_newsitem_fts.rowid
+    WHERE newsfeed_newsitem_fts MATCH %s
+      AND item.feed_id IN (SELECT feed_id FROM newsfeed_sourcerss WHERE user_id = %s)
+    ORDER BY bm25(newsfeed_newsitem_fts, 2.0, 1.0)
+    LIMIT %s
+"""
+
+POSTGRESQL_SEARCH = """
+    SELECT item.id FROM newsfeed_newsitem item, websearch_to_tsquery('english', %s) query
+    WHERE item.search_vector @@ query
+      AND item.feed_id IN (SELECT feed_id FROM newsfeed_sourcerss WHERE user_id = %s)
+    ORDER BY ts_rank(item.search_vector, query) DESC
+    LIMIT %s
+"""
+
+
+def ensure_sqlite_triggers(sender=None, using='default', **kwargs):
+    """
+    Puts back the triggers that keep the FTS5 index current. SQLite migrations that
+    alter the items table rebuild it, which drops its triggers, so this runs after
+    every migrate (see NewsfeedConfig.ready).
+    """
+    database = connections[using]
+    if database.vendor != 'sqlite' or 'newsfeed_newsitem_fts' not in database.introspection.table_names():
+        return
+    with database.cursor() as cursor:
+        for statement in SQLITE_TRIGGERS:
+            cursor.execute(statement)
+
+
+def _fts5_query(query):
+    # quote every word, so the user's text can't be read as FTS5 query syntax
+    return ' '.join('"%s"' % word for word in re.findall(r'\w+', query))
+
+
+def search_items(user, query, limit=20):
+    """
+    Returns up to limit news items of the feeds user subscribes to that match
+    query, best match first, annotated like NewsItem.objects.for_user().
+
+    The matching and ranking are done by the database's full-text index: FTS5 on
+    SQLite and a tsvector column with a GIN index on PostgreSQL (both added by
+    migration 0013). Other databases fall back to scanning titles and summaries.
+    """
+    query = query.strip()
+    if not query:
+        return []
+
+    items = NewsItem.objects.for_user(user)
+    if connection.vendor == 'sqlite':
+        query = _fts5_query(query)
+        if not query:
+            return []
+        sql = SQLITE_SEARCH
+    elif connection.vendor == 'postgresql':
+        sql = POSTGRESQL_SEARCH
+    else:
+        matches = Q(title__icontains=query) | Q(summary__icontains=query)
+        return list(items.filter(matches)[:limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [query, user.pk, limit])
+        ids = [row[0] for row in cursor.fetchall()]
+    found = items.in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
@@ -0,0 +1,167 @@
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from xml.etree.ElementTree import XMLPullParser
+
+from .normalization import entry_key
+
+CHUNK_SIZE = 64 * 1024
+
+# RSS 0.9x/1.0/2.0 and Atom element names (without namespace) of an entry
+ENTRY_TAGS = {'item', 'entry'}
+# entry element -> key of the feedparser-like entry dict
+ENTRY_FIELDS = {
+    'title': 'title',
+    'guid': 'id',
+    'id': 'id',
+    'description': 'summary',
+    'summary': 'summary',
+    'encoded': 'content',  # content:encoded
+    'content': 'content',
+    'pubDate': 'published_parsed',
+    'published': 'published_parsed',
+    'issued': 'published_parsed',
+    'date': 'published_parsed',  # dc:date
+    'updated': 'updated_parsed',
+    'modified': 'updated_parsed',
+}
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _text(element):
+    return ''.join(element.itertext()).strip()
+
+
+def _parse_date(value):
+    """
+    Returns an RFC 822 (RSS) or ISO 8601 (Atom) date as a UTC struct_time, like
+    feedparser's *_parsed values, or None if it can't be read.
+    """
+    value = value.strip()
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            parsed = parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            return None
+    # naive dates are taken as UTC
+    return parsed.utctimetuple()
+
+
+class StreamingFeed:
+    """
+    Parses an RSS or Atom document with a pull parser, a chunk at a time, and
+    yields its entries as they are read, instead of building the whole document
+    first like feedparser.parse. Each entry is dropped from memory once yielded.
+
+    It reads like the result of feedparser.parse: entries is a generator of dicts
+    with the keys add_news_items looks at, and feed holds the feed's title once
+    entries has been iterated.
+
+    Reading stops early after max_entries entries, or after stop_after_known
+    entries in a row whose dedup key is in known_keys: feeds list their newest
+    entries first, so the rest of the document is already stored. Entries that
+    are known aren't yielded.
+
+    A complete=False body (cut off by the download limit) ends without an error
+    wherever it was cut. Malformed XML raises ParseError, possibly after some
+    entries were yielded.
+    """
+
+    def __init__(self, body, known_keys=frozenset(), max_entries=None, stop_after_known=1, complete=True):
+        self.body = body
+        self.known_keys = known_keys
+        self.max_entries = max_entries
+        self.stop_after_known = stop_after_known
+        self.complete = complete
+        self.feed = {}
+        # why reading stopped before the end of the document: 'known', 'max_entries' or None
+        self.stopped = None
+        self.entries = self._entries()
+        # the open elements, innermost last, and the entry being read
+        self._stack = []
+        self._entry = None
+
+    def _entries(self):
+        parser = XMLPullParser(events=('start', 'end'))
+        body = memoryview(self.body)
+        yielded = known_in_a_row = 0
+
+        for start in range(0, len(body), CHUNK_SIZE):
+            parser.feed(body[start:start + CHUNK_SIZE])
+            for entry in self._read(parser):
+                if entry_key(entry.get('id'), entry.get('link'), entry.get('title')) in self.known_keys:
+                    known_in_a_row += 1
+                    if known_in_a_row >= self.stop_after_known:
+                        self.stopped = 'known'
+                        return
+                    continue
+                known_in_a_row = 0
+                yield entry
+                yielded += 1
+                if self.max_entries is not None and yielded >= self.max_entries:
+                    self.stopped = 'max_entries'
+                    return
+        if self.complete:
+            # raises ParseError if the document isn't finished
+            parser.close()
+
+    def _read(self, parser):
+        stack = self._stack
+
+        for event, element in parser.read_events():
+            name = _local_name(element.tag)
+            if event == 'start':
+                stack.append(element)
+                if name in ENTRY_TAGS and self._entry is None:
+                    self._entry = element
+                continue
+
+            stack.pop()
+            parent = stack[-1] if stack else None
+            if element is self._entry:
+                self._entry = None
+                entry = self._parse_entry(element)
+                # forget the entry, the document's root would keep it otherwise
+                if parent is not None:
+                    parent.remove(element)
+                if entry.get('title') or entry.get('link'):
+                    yield entry
+            elif self._entry is None and name == 'title' and 'title' not in self.feed \
+                    and parent is not None and _local_name(parent.tag) in ('channel', 'feed'):
+                self.feed['title'] = _text(element)
+
+    @staticmethod
+    def _parse_entry(element):
+        entry = {}
+        permalink = None
+        for child in element:
+            name = _local_name(child.tag)
+            if name == 'link':
+                href = child.get('href')
+                if href is None:
+                    entry.setdefault('link', _text(child))
+                elif child.get('rel', 'alternate') == 'alternate':
+                    entry.setdefault('link', href.strip())
+                continue
+            key = ENTRY_FIELDS.get(name)
+            if key is None or key in entry:
+                continue
+            if key.endswith('_parsed'):
+                parsed = _parse_date(_text(child))
+                if parsed is not None:
+                    entry[key] = parsed
+            else:
+                entry[key] = _text(child)
+            if name == 'guid' and child.get('isPermaLink', 'true') == 'true':
+                permalink = entry['id']
+
+        if 'link' not in entry and permalink and permalink.startswith(('http://', 'https://')):
+            entry['link'] = permalink
+        if 'summary' not in entry and 'content' in entry:
+            entry['summary'] = entry['content']
+        entry.pop('content', None)
+        return entry
@@ -1,13 +1,37 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'newsfeed'
 
 urlpatterns = [
+    # localhost:8000/newsfeed/api/items/
+    path('api/items/', api.items, name='api_items'),
+
+    # localhost:8000/newsfeed/api/items/export/
+    path('api/items/export/', api.export_items, name='api_export_items'),
+
+    # localhost:8000/newsfeed/api/items/<news_id>/comments/
+    path('api/items/<int:news_id>/comments/', api.comments, name='api_comments'),
+
+    # localhost:8000/newsfeed/api/search/?q=<words>
+    path('api/search/', api.search, name='api_search'),
+
+    # localhost:8000/newsfeed/api/sources/
+    path('api/sources/', api.sources, name='api_sources'),
+
+    # localhost:8000/newsfeed/events/
+    path('events/', views.events, name='events'),
+
+    # localhost:8000/newsfeed/metrics/
+    path('metrics/', views.metrics, name='metrics'),
+
     # localhost:8000/newsfeed/sources/
     path('sources/', views.list_sources, name='list_sources'),
 
-    # localhost:8000/newsfeed/<str:all/favorites>
+    # localhost:8000/newsfeed/search/?q=<words>
+    path('search/', views.search, name='search'),
+
+    # localhost:8000/newsfeed/<str:all/favorites/unread/hidden>
     path('<str:sort_by>/', views.newsfeed, name='newsfeed'),
 
     # localhost:8000/newsfeed/<news_id>/comments
@@ -19,6 +43,12 @@ urlpatterns = [
     # localhost:8000/newsfeed/favorite/<news_id>/
     path('favorite/<int:news_id>/', views.favorite, name='favorite'),
 
+    # localhost:8000/newsfeed/hide/<news_id>/
+    path('hide/<int:news_id>/', views.hide, name='hide'),
+
+    # localhost:8000/newsfeed/read/<news_id>/
+    path('read/<int:news_id>/', views.mark_read, name='read'),
+
     # localhost:8000/newsfeed/sources/add_source/
     path('sources/add_source/', views.add_source, name='add_source'),
 
@@ -1,64 +1,382 @@
-import feedparser
-from django.db import IntegrityError
+import logging
+import multiprocessing
+import queue
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
+from datetime import datetime, timezone as dt_timezone
 
-from .models import SourceRSS, NewsItem
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
 
+from .cache import invalidate_feed
+from .events import publish_items
+from .fetcher import FeedRequest, fetch_feeds, poll_not_before
+from .metrics import track_feed
+from .models import Feed, NewsItem
+from .normalization import display_url, entry_key
+from .parsing import ParsedFeed, parse_feed
+from .rawcache import content_hash, record, replay_feeds
 
-def rss_parser(sources_pks):
+logger = logging.getLogger(__name__)
+
+IngestResult = namedtuple('IngestResult', ['inserted', 'skipped'])
+
+# not_before is the earliest next poll the server asked for (Retry-After, Cache-Control, Expires)
+PollResult = namedtuple('PollResult', ['status', 'error', 'elapsed', 'inserted', 'not_before'])
+
+
+def rss_parser(feeds_pks):
     """
-    Takes a list of SourceRSS.pk and parses their urls.
-    If the source has been parsed before, only gets the new items.
+    Takes a list of Feed.pk and parses their urls.
+    If the feed has been parsed before, only gets the new items: its ETag and
+    Last-Modified validators are sent along and a 304 answer isn't parsed at all.
 
-    sources is a dictionary containing the RSS url, an ETag or Last-Modified tag,
-    and the value of the tag.
+    The feeds are downloaded concurrently and parsed in other processes (see
+    parse_responses), and each one is stored in this thread as soon as it's parsed.
+    Each feed is fetched once, however many users subscribe to it.
+
+    Returns a dictionary mapping each Feed.pk to the PollResult of its fetch.
     """
+    feeds = Feed.objects.in_bulk(feeds_pks)
+    requests = [FeedRequest(feed.pk, feed.url, conditional_headers(feed)) for feed in feeds.values()]
 
-    for key in sources_pks:
-        source = SourceRSS.objects.get(pk=key)
-        url = source.source_url
-        tag = source.last_modified_tag
-        value = source.last_modified_value
+    results = {}
+    for response, parsed in parse_responses(requests, feeds):
+        results[response.key] = track_feed(_handle_response, feeds[response.key], response, parsed)
+    return results
 
-        if tag:
-            # source has been parsed before
-            if tag == 'ETag':
-                items = feedparser.parse(url, etag=value)
-                if items.status == 304:
-                    continue
-            else:
-                items = feedparser.parse(url, modified=value)
 
-        else:
-            # source has never been parsed before or tags don't work for it
-            items = feedparser.parse(url)
-            try:
-                source.last_modified_value = items.etag
-                source.last_modified_tag = 'ETag'
-                source.save()
-            except (KeyError, AttributeError):
+# put in the download queue after the last response
+_DONE = object()
+
+# parse processes, by number of processes, kept for the life of the refresher
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def parse_responses(requests, feeds, processes=None):
+    """
+    Downloads the FeedRequests of feeds (a dictionary of Feeds by pk) and parses
+    the bodies that came back, yielding each FeedResponse with its ParsedFeed, or
+    None when there was nothing to parse, as soon as it's ready. The caller stores
+    them, a feed at a time. A body identical to the one last stored for its feed
+    (see Feed.content_hash) isn't parsed.
+
+    Downloaded bodies are kept in the raw response cache when NEWSFEED_RAW_CACHE_DIR
+    is set, and with NEWSFEED_RAW_CACHE_REPLAY the responses come from that cache
+    instead of the network (see rawcache).
+
+    The stages run side by side: downloads in threads (see fetcher.fetch_feeds),
+    parses in a pool of processes, which neither hold up the downloads nor each
+    other the way parsing in the same process would, and storing in the caller's
+    thread, the only one with a database connection. processes
+    (NEWSFEED_PARSE_PROCESSES by default) is the size of the pool; with 0 the
+    caller's thread parses too.
+
+    At most twice as many responses as there are processes wait to be parsed and
+    as many are being parsed: when parsing or storing falls behind, the stages
+    before it wait instead of piling up bodies in memory.
+    """
+    processes = settings.NEWSFEED_PARSE_PROCESSES if processes is None else processes
+    limit = 2 * max(processes, 1)
+    downloaded = queue.Queue(maxsize=limit)
+    stop = threading.Event()
+    errors = []
+    if settings.NEWSFEED_RAW_CACHE_REPLAY:
+        fetch, directory = replay_feeds, None
+    else:
+        fetch, directory = fetch_feeds, settings.NEWSFEED_RAW_CACHE_DIR
+    downloader = threading.Thread(target=_download, args=(fetch, requests, directory, downloaded, stop, errors),
+                                  daemon=True)
+    downloader.start()
+
+    # future of each parse -> its response
+    parsing = {}
+    finished = False
+    try:
+        while not finished or parsing:
+            waiting = not finished and len(parsing) < limit
+            if waiting:
                 try:
-                    source.last_modified_value = items.modified
-                    source.last_modified_tag = 'Last-Modified'
-                    source.save()
-                except (KeyError, AttributeError):
+                    response = downloaded.get(timeout=0.05 if parsing else None)
+                except queue.Empty:
+                    response = None
+                if response is _DONE:
+                    finished = True
+                elif response is None:
                     pass
-        add_news_items(items.entries, source)
+                elif response.error is not None or response.status == 304 or response.status >= 400:
+                    yield response, None
+                elif content_hash(response.body) == feeds[response.key].content_hash:
+                    # the very document stored last time, there is nothing new in it
+                    yield response, None
+                elif processes:
+                    parsing[_submit_parse(processes, _parse_arguments(feeds[response.key], response))] = response
+                else:
+                    yield response, _parse(parse_feed, *_parse_arguments(feeds[response.key], response))
+            if parsing:
+                done, _ = wait(parsing, timeout=0 if waiting else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield parsing.pop(future), _parse(future.result)
+        if errors:
+            raise errors[0]
+    finally:
+        # the caller gave up: stop downloading, and let the downloader get out of a full queue
+        stop.set()
+        while downloader.is_alive():
+            try:
+                downloaded.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        for future in parsing:
+            future.cancel()
+
 
+def _download(fetch, requests, directory, downloaded, stop, errors):
+    # records the downloaded bodies in the raw response cache at directory, if any
+    try:
+        with closing(fetch(requests)) as responses:
+            for response in responses:
+                if directory and response.status == 200 and response.error is None:
+                    record(response, directory)
+                downloaded.put(response)
+                if stop.is_set():
+                    break
+    except Exception as error:
+        errors.append(error)
+    finally:
+        downloaded.put(_DONE)
 
-def add_news_items(items, source):
+
+def _parse_arguments(feed, response):
+    """
+    Returns the arguments of parsing.parse_feed for the body of feed's response.
+    Bodies of NEWSFEED_STREAM_PARSE_MIN_BYTES or more are streamed and stop at the
+    items stored by an earlier poll, smaller ones are read by feedparser, which is
+    more forgiving and cleans up more.
+    """
+    max_entries = settings.NEWSFEED_FEED_MAX_ENTRIES
+    min_bytes = settings.NEWSFEED_STREAM_PARSE_MIN_BYTES
+    stream = min_bytes is not None and len(response.body) >= min_bytes
+    known_keys = set()
+    if stream:
+        known_keys = set(NewsItem.objects.filter(feed=feed).order_by('-id')
+                         .values_list('dedup_key', flat=True)[:max_entries])
+    return (response.body, response.headers, stream, known_keys, max_entries,
+            settings.NEWSFEED_STREAM_STOP_AFTER_KNOWN, not response.truncated)
+
+
+def _parse(parse, *args):
+    # a failed parse is a ParsedFeed with the error, like a failed download is a FeedResponse
+    try:
+        return parse(*args)
+    except Exception as error:
+        return ParsedFeed(None, [], 0, error=error)
+
+
+def _submit_parse(processes, arguments):
+    pool = _parse_pool(processes)
+    try:
+        return pool.submit(parse_feed, *arguments)
+    except BrokenProcessPool:
+        # a parse process died (e.g. out of memory), start over with a new pool
+        return _parse_pool(processes, broken=pool).submit(parse_feed, *arguments)
+
+
+def _parse_pool(processes, broken=None):
+    with _pools_lock:
+        pool = _pools.get(processes)
+        if pool is None or pool is broken:
+            if pool is not None:
+                pool.shutdown(wait=False)
+            # not fork: the refresher has threads and database connections a fork would copy
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            pool = _pools[processes] = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context(method))
+        return pool
+
+
+def _handle_response(feed, response, parsed):
+    """
+    Stores the items and HTTP cache state of a single fetched feed, parsed into
+    parsed unless the download failed, was answered with 304 or brought the body
+    stored last time.
+    """
+    if response.error is not None:
+        logger.warning('Fetching %s failed: %s', display_url(response.url), response.error)
+        return PollResult(None, response.error, response.elapsed, 0, None)
+
+    not_before = poll_not_before(response.headers, timezone.now())
+    etag = response.headers.get('etag')
+    last_modified = response.headers.get('last-modified')
+
+    if response.status == 304:
+        # nothing new since the last fetch, we were spared the download and the parse
+        Feed.objects.filter(pk=feed.pk).update(
+            etag=etag or feed.etag,
+            last_modified=last_modified or feed.last_modified,
+            not_modified_count=F('not_modified_count') + 1,
+            bytes_saved=F('bytes_saved') + feed.last_body_size,
+        )
+        return PollResult(304, None, response.elapsed, 0, not_before)
+    if response.status >= 400:
+        logger.warning('Fetching %s failed with HTTP %s', display_url(response.url), response.status)
+        return PollResult(response.status, None, response.elapsed, 0, not_before)
+
+    if response.truncated:
+        logger.warning('%s is larger than %d bytes, only reading that much', display_url(response.url),
+                       settings.NEWSFEED_FETCH_MAX_BYTES)
+    if parsed is None:
+        # the same body as last time (see parse_responses), only the validators may have changed
+        Feed.objects.filter(pk=feed.pk).update(
+            etag=etag or feed.etag,
+            last_modified=last_modified or feed.last_modified,
+            unchanged_count=F('unchanged_count') + 1,
+        )
+        return PollResult(response.status, None, response.elapsed, 0, not_before)
+    if parsed.error is not None:
+        logger.error('Parsing %s failed', display_url(response.url), exc_info=parsed.error)
+        return PollResult(response.status, parsed.error, response.elapsed, 0, not_before)
+    if parsed.stream_error is not None:
+        logger.info('Streaming parse of %s failed (%s), fell back to feedparser', display_url(response.url),
+                    parsed.stream_error)
+    try:
+        inserted = add_news_items(parsed.entries, feed).inserted
+    except Exception as error:
+        logger.exception('Storing %s failed', display_url(response.url))
+        return PollResult(response.status, error, response.elapsed, 0, not_before)
+
+    # only remember the validators once the items are stored, or a failed parse would be answered with 304
+    feed.title = (parsed.title or feed.title)[:200]
+    feed.etag = etag
+    feed.last_modified = last_modified
+    feed.last_body_size = len(response.body)
+    feed.content_hash = content_hash(response.body)
+    feed.save(update_fields=['title', 'etag', 'last_modified', 'last_body_size', 'content_hash'])
+    return PollResult(response.status, None, response.elapsed, inserted, not_before)
+
+
+def parse_and_store(feed, response):
+    """
+    Parses the body of a feed's response in this thread, like parse_responses
+    would, and stores its new items, at most NEWSFEED_FEED_MAX_ENTRIES of them.
+    Returns the feed's title and the number of items inserted.
+    """
+    parsed = parse_feed(*_parse_arguments(feed, response))
+    return parsed.title, add_news_items(parsed.entries, feed).inserted
+
+
+def conditional_headers(feed):
+    """
+    Returns the request headers that let the server answer 304 if the feed
+    hasn't changed since it was last parsed.
+    """
+    headers = {}
+    if feed.etag:
+        headers['If-None-Match'] = feed.etag
+    if feed.last_modified:
+        headers['If-Modified-Since'] = feed.last_modified
+    return headers
+
+
+def add_news_items(items, feed, batch_size=None):
     """
     Adds parsed news items to the database.
+
+    Entries are identified by their dedup key (see normalization.entry_key). The items
+    are handled batch_size at a time: entries repeated within the batch are dropped,
+    the keys already stored for the feed are found with a single query, and only
+    the new ones are inserted with one bulk INSERT.
+
+    Returns an IngestResult with the number of inserted and skipped items.
+    """
+    batch_size = batch_size or settings.NEWSFEED_INGEST_BATCH_SIZE
+    total = inserted = 0
+    batch = OrderedDict()
+    fetched_at = timezone.now()
+
+    try:
+        for item in items:
+            total += 1
+            title = item.get('title')
+            link = item.get('link', '')
+            key = entry_key(item.get('id'), link, title)
+            if not title or key in batch:
+                continue
+            batch[key] = NewsItem(feed=feed, title=title, link=link, summary=item.get('summary', ''),
+                                  published_at=entry_published_at(item, fetched_at), fetched_at=fetched_at,
+                                  dedup_key=key)
+            if len(batch) >= batch_size:
+                inserted += _insert_new_items(batch, feed)
+                batch = OrderedDict()
+        if batch:
+            inserted += _insert_new_items(batch, feed)
+    finally:
+        # items may be a generator that fails halfway, after some batches were stored
+        if inserted:
+            invalidate_feed(feed)
+
+    return IngestResult(inserted, total - inserted)
+
+
+def entry_published_at(item, fetched_at):
+    """
+    Returns when a parsed entry was published, going by its published, updated or
+    created date in that order. Entries without any date, or dated in the future,
+    count as published when they were fetched.
     """
-    for item in items:
-        news_item = NewsItem()
-        news_item.source = source
-        news_item.title = item.title
-        news_item.link = item.link
-        try:
-            news_item.summary = item.summary
-        except AttributeError:
-            news_item.summary = ""
-        try:
-            news_item.save()
-        except IntegrityError:
-            continue
+    for name in ('published_parsed', 'updated_parsed', 'created_parsed'):
+        parsed = item.get(name)
+        if parsed:
+            # feedparser normalizes every date to a UTC struct_time
+            published_at = datetime(*parsed[:6], tzinfo=dt_timezone.utc)
+            return min(published_at, fetched_at)
+    return fetched_at
+
+
+def _insert_new_items(batch, feed):
+    """
+    Inserts the NewsItems of batch (keyed by dedup key) that aren't stored yet for feed,
+    and publishes them to the event stream. Returns the number of rows inserted.
+
+    Items stored before entries were keyed by their guid (see migration 0004) carry
+    the key of their link, or title. An entry with a guid matches such a row too,
+    and the row is given the entry's key the first time it comes again.
+    """
+    legacy = {}
+    for key, news_item in batch.items():
+        fallback = entry_key(None, news_item.link, news_item.title)
+        if fallback != key and fallback not in batch:
+            legacy[fallback] = key
+    stored = set(NewsItem.objects.filter(feed=feed, dedup_key__in=list(batch) + list(legacy))
+                 .values_list('dedup_key', flat=True))
+    existing = stored & batch.keys()
+    for fallback in stored & legacy.keys():
+        if legacy[fallback] not in existing:
+            NewsItem.objects.filter(feed=feed, dedup_key=fallback).update(dedup_key=legacy[fallback])
+            existing.add(legacy[fallback])
+    new_items = [news_item for key, news_item in batch.items() if key not in existing]
+    if not new_items:
+        return 0
+
+    try:
+        with transaction.atomic():
+            NewsItem.objects.bulk_create(new_items)
+    except IntegrityError:
+        # another process stored some of them since the lookup, fall back to one by one
+        saved = []
+        for news_item in new_items:
+            news_item.pk = None
+            try:
+                with transaction.atomic():
+                    news_item.save()
+                saved.append(news_item)
+            except IntegrityError:
+                continue
+        new_items = saved
+    publish_items(new_items)
+    return len(new_items)
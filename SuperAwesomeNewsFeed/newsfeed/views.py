@@ -1,49 +1,89 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect, aget_object_or_404, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.cache import cache_control
 
-from .models import SourceRSS, NewsItem, Comments
+from .models import SourceRSS, NewsItem, ItemState, Comments
+from .cache import cached_page, invalidate_feed, invalidate_users
 from .forms import SourceForm, CommentForm
-from .utils import rss_parser
+from .events import can_stream, publish_comment_count, stream_events
+from .freshness import async_condition, comments_etag, feed_etag
+from .likes import like
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, enabled as metrics_enabled, render as render_metrics
+from .pagination import InvalidCursor, apaginate, parse_since
+from .search import search_items
 
 
+# The read-heavy views below are async: while they wait on the database or the
+# cache a process served over ASGI gets on with other requests instead of
+# holding a thread per request.
+
 @login_required(login_url='/login/')
-def newsfeed(request, sort_by):
-    sources = list()
-    for source in SourceRSS.objects.filter(user=request.user):
-        sources.append(source.pk)
+@cache_control(private=True, no_cache=True)
+@async_condition(etag_func=feed_etag)
+@cached_page(etag_func=feed_etag)
+async def newsfeed(request, sort_by):
+    # sources are polled by the refresh_feeds command, this view only reads
+    user = await request.auser()
+    news = NewsItem.objects.for_user(user).listing(user, sort_by)
+    since = parse_since(request.GET.get('since'))
+    if since is not None:
+        news = news.since(since)
+
+    try:
+        page = await apaginate(news, request.GET.get('cursor'))
+    except InvalidCursor:
+        page = await apaginate(news)
 
-    rss_parser(sources)
-    if sort_by == 'favorites':
-        news = NewsItem.objects.filter(favorite=True)
-    else:
-        news = NewsItem.objects.all()
+    context = {
+        'news': page.items,
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+        'since': request.GET.get('since', '') if since is not None else '',
+        'live_updates': can_stream(request),
+    }
+
+    return render(request, 'newsfeed/newsfeed.html', context)
 
+
+@login_required(login_url='/login/')
+async def search(request):
+    query = request.GET.get('q', '')
     context = {
-        'news': news
+        'news': await sync_to_async(search_items)(await request.auser(), query, settings.NEWSFEED_SEARCH_LIMIT),
+        'query': query,
+        'live_updates': can_stream(request),
     }
 
     return render(request, 'newsfeed/newsfeed.html', context)
 
 
 @login_required(login_url='/login/')
-def comments(request, news_id):
-    news_item = get_object_or_404(NewsItem, pk=news_id)
-    all_comments = Comments.objects.filter(news_item=news_item)
+@cache_control(private=True, no_cache=True)
+@async_condition(etag_func=comments_etag)
+@cached_page(forms=True, etag_func=comments_etag)
+async def comments(request, news_id):
+    news_item = await aget_object_or_404(NewsItem, pk=news_id)
 
     form = CommentForm(request.POST or None)
-    news_item = get_object_or_404(NewsItem, pk=news_id)
     if form.is_valid():
         comment = form.save(commit=False)
-        comment.user = request.user
+        comment.user = await request.auser()
         comment.news_item = news_item
-        comment.save()
+        await comment.asave()
+        await sync_to_async(invalidate_feed)(news_item.feed_id)
+        await sync_to_async(publish_comment_count)(news_item)
 
         return redirect('newsfeed:comments', news_id)
 
     context = {
         'news_item': news_item,
-        'comments': all_comments,
-        "form": form
+        'comments': [comment async for comment in Comments.objects.filter(news_item=news_item)
+                     .select_related('user')],
+        "form": form,
+        'live_updates': can_stream(request),
     }
 
     return render(request, 'newsfeed/comments.html', context)
@@ -52,24 +92,39 @@ def comments(request, news_id):
 @login_required(login_url='/login/')
 def like_comment(request, comment_id):
     comment = get_object_or_404(Comments, pk=comment_id)
-    comment.likes += 1
-    comment.save()
+    like(request.user, comment)
 
-    return redirect('newsfeed:comments', comment.news_item.pk)
+    return redirect('newsfeed:comments', comment.news_item_id)
 
 
 @login_required(login_url='/login/')
 def favorite(request, news_id):
-    news = get_object_or_404(NewsItem, pk=news_id)
-    news.favorite = not news.favorite
-    news.save()
+    return _toggle_state(request, news_id, ItemState.FAVORITE)
+
+
+@login_required(login_url='/login/')
+def hide(request, news_id):
+    return _toggle_state(request, news_id, ItemState.HIDDEN)
+
+
+@login_required(login_url='/login/')
+def mark_read(request, news_id):
+    return _toggle_state(request, news_id, ItemState.READ)
+
+
+def _toggle_state(request, news_id, state):
+    # not joined through the subscriptions, a user may have two sources on the same feed
+    news = get_object_or_404(NewsItem, pk=news_id, feed__in=SourceRSS.objects.filter(user=request.user).values('feed'))
+    ItemState.objects.toggle(request.user, news, state)
+    invalidate_users([request.user.pk])
 
     return redirect('newsfeed:newsfeed', 'all')
 
 
 @login_required(login_url='/login/')
-def list_sources(request):
-    sources = SourceRSS.objects.all()
+@cached_page(forms=True)
+async def list_sources(request):
+    sources = [source async for source in SourceRSS.objects.filter(user=await request.auser())]
     context = {
         'sources_list': sources
     }
@@ -78,12 +133,14 @@ def list_sources(request):
 
 
 @login_required(login_url='/login/')
+@cached_page(forms=True)
 def add_source(request):
     form = SourceForm(request.POST or None)
     if form.is_valid():
         source = form.save(commit=False)
         source.user = request.user
         source.save()
+        invalidate_users([request.user.pk])
 
         return redirect('newsfeed:list_sources')
 
@@ -98,5 +155,43 @@ def add_source(request):
 def delete_source(request, source_id):
     source = SourceRSS.objects.get(pk=source_id)
     source.delete()
+    invalidate_users([source.user_id])
 
     return redirect('newsfeed:list_sources')
+
+
+async def events(request):
+    """
+    Streams the new items of the user's feeds and the comment and like counts of
+    their items as Server-Sent Events. A reconnecting browser sends the id of the
+    last event it got as Last-Event-ID and is sent what it missed first.
+
+    The view is async, so an open stream holds no worker thread. It only streams
+    when served over ASGI, under WSGI it answers 204 No Content, which tells the
+    browser not to reconnect.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse('Authentication required', status=401, content_type='text/plain')
+    if not can_stream(request):
+        return HttpResponse(status=204)
+
+    feed_ids = [feed_id async for feed_id in SourceRSS.objects.filter(user=user).values_list('feed_id', flat=True)]
+    last_event_id = request.headers.get('Last-Event-ID', request.GET.get('last_event_id')) or None
+    response = StreamingHttpResponse(stream_events(feed_ids, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # tell nginx not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def metrics(request):
+    """
+    This process's request and feed fetch metrics in the Prometheus text format, for
+    staff users and scrapers at the addresses in NEWSFEED_METRICS_ALLOWED_IPS.
+    """
+    if not metrics_enabled():
+        raise Http404
+    if not (request.user.is_staff or request.META.get('REMOTE_ADDR') in settings.NEWSFEED_METRICS_ALLOWED_IPS):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)